@@ -18,6 +18,7 @@ class Config:
         config_data = self.load_config_file(filename)
 
         self.command_prefix: str = config_data.get("command_prefix", "-")
+        self.log_level: str = config_data.get("log_level", "INFO")
 
         # Stats and Usage data
         self.data_dir: str = config_data.get("data_dir", "data")
@@ -35,6 +36,12 @@ class Config:
         self.enable_stats_usage_graph: bool = config_data.get(
             "enable_stats_usage_graph", False
         )
+        self.usage_database_batch_size: int = config_data.get(
+            "usage_database_batch_size", 100
+        )
+        self.usage_database_flush_interval: float = config_data.get(
+            "usage_database_flush_interval", 0.5
+        )
 
         # Music
         self.max_displayed_songs: int = config_data.get("max_displayed_songs", 25)
@@ -43,6 +50,12 @@ class Config:
             "yt_search_playlist_song_limit", 10
         )
         self.inactivity_timeout: int = config_data.get("inactivity_timeout", 600)
+        self.yt_search_cache_size: int = config_data.get("yt_search_cache_size", 1024)
+        self.yt_search_cache_ttl: float = config_data.get("yt_search_cache_ttl", 21600)
+        self.spotify_cache_size: int = config_data.get("spotify_cache_size", 1024)
+        self.spotify_cache_ttl: float = config_data.get("spotify_cache_ttl", 3600)
+        self.ytdl_video_cache_size: int = config_data.get("ytdl_video_cache_size", 256)
+        self.prefetch_depth: int = config_data.get("prefetch_depth", 2)
 
         # Concurrency
         self.enable_multiprocessing: bool = config_data.get(
@@ -50,6 +63,18 @@ class Config:
         )
         self.process_pool_workers: int = config_data.get("process_pool_workers", None)
         self.thread_pool_workers: int = config_data.get("thread_pool_workers", 4)
+        self.playlist_concurrency: int = config_data.get("playlist_concurrency", 8)
+        self.ytdl_requests_per_second: float = config_data.get(
+            "ytdl_requests_per_second", 5
+        )
+        self.ytdl_max_retries: int = config_data.get("ytdl_max_retries", 3)
+        self.spotify_thread_pool_workers: int = config_data.get(
+            "spotify_thread_pool_workers", 8
+        )
+        self.spotify_page_concurrency: int = config_data.get(
+            "spotify_page_concurrency", 10
+        )
+        self.spotify_max_retries: int = config_data.get("spotify_max_retries", 3)
 
         print(f"spotify song limit: {self.playlist_song_limit}")
 
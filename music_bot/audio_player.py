@@ -1,8 +1,10 @@
 """Contains class AudioPlayer to poll the song queue and play audio in discord."""
 
 import asyncio
-import traceback
+import logging
+from collections.abc import Sequence
 from queue import LifoQueue
+from typing import Optional
 
 from discord import Embed, VoiceClient
 
@@ -10,6 +12,9 @@ from config import Config
 
 from .song import Song, SongQueue
 from .usage_database import UsageDatabase
+from .ytdl_source import YtdlSourceFactory
+
+logger = logging.getLogger(__name__)
 
 
 class AudioError(Exception):
@@ -24,6 +29,7 @@ class AudioPlayer:
     Attributes:
         config: A Config object representing the configuration of the music bot.
         usage_db: A UsageDatabase object representing the database tracking usage data for the music bot.
+        ytdl_source_factory: YtdlSourceFactory object used to refresh the stream urls of songs before they're played.
         current_song: Song object representing the current song playing (or about to be played).
         voice_client: The discord VoiceClient object to play audio with.
         song_queue: The SongQueue object to poll songs from.
@@ -31,17 +37,27 @@ class AudioPlayer:
         play_next_song_event: An asyncio.Event object indicating if it's time to play the next song.
         audio_player_task: An asyncio.Task that continuously polls the song queue
             and plays audio with the discord client.
+        prefetch_task: An asyncio.Task that refreshes the stream urls of the next songs in the queue
+            while the current song plays.
     """
 
-    def __init__(self, config: Config, usage_db: UsageDatabase) -> None:
+    def __init__(
+        self,
+        config: Config,
+        usage_db: UsageDatabase,
+        ytdl_source_factory: YtdlSourceFactory,
+    ) -> None:
         """Initializes the audio player.
 
         Args:
             config: A Config object representing the configuration of the music bot.
             usage_db: A UsageDatabase object representing the database tracking usage data for the music bot.
+            ytdl_source_factory: YtdlSourceFactory object used to refresh the stream urls of songs
+                before they're played.
         """
         self.config: Config = config
         self.usage_db: UsageDatabase = usage_db
+        self.ytdl_source_factory: YtdlSourceFactory = ytdl_source_factory
         self.prev_songs: list[Song] = []
         self.push_to_prev_songs: bool = True
         self.current_song: Song = None
@@ -50,11 +66,7 @@ class AudioPlayer:
         self.event_loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
         self.play_next_song_event: asyncio.Event = asyncio.Event()
         self.audio_player_task: asyncio.Task = None
-
-    def __del__(self) -> None:
-        """Cancels the audio player task before destroying the audio player object."""
-        if self.audio_player_task:
-            self.audio_player_task.cancel()
+        self.prefetch_task: asyncio.Task = None
 
     @property
     def is_currently_playing(self) -> bool:
@@ -80,7 +92,7 @@ class AudioPlayer:
 
     def start_audio_player(self) -> None:
         """Starts the audio player task."""
-        print("Starting the audio player.")
+        logger.debug("Starting the audio player.")
         self.audio_player_task = self.event_loop.create_task(self.play_audio())
 
     async def play_audio(self) -> None:
@@ -94,7 +106,6 @@ class AudioPlayer:
                 self.play_next_song_event.clear()
 
                 try:
-                    print("About to wait for next song.")
                     await asyncio.wait_for(
                         self.poll_song_queue(), self.config.inactivity_timeout
                     )
@@ -102,34 +113,104 @@ class AudioPlayer:
                     await self.leave()
                     return
 
-                print(f"about to play song: {self.current_song}")
+                logger.debug("About to play song: %s", self.current_song)
+                # Songs can wait in the queue long enough for their stream urls to expire, and a url that
+                # expires partway through the song breaks ffmpeg's reconnects
+                ytdl_video_source = self.current_song.ytdl_video_source
+                if ytdl_video_source.is_stream_url_expiring(
+                    ytdl_video_source.duration or 0
+                ):
+                    try:
+                        await self.ytdl_source_factory.process_ytdl_video_source(
+                            ytdl_video_source
+                        )
+                    except Exception:
+                        logger.warning(
+                            "Failed to refresh song %s",
+                            self.current_song,
+                            exc_info=True,
+                        )
+                        skipped_song, self.current_song = self.current_song, None
+                        await skipped_song.channel_where_requested.send(
+                            f"Skipped {skipped_song} because it couldn't be loaded."
+                        )
+                        continue
                 self.current_song.record_start()
                 self.voice_client.play(
-                    self.current_song.audio_source, after=self.play_next_song
+                    self.current_song.create_audio_source(), after=self.play_next_song
                 )
+                self.prefetch_upcoming_songs(self.current_song)
 
-                print(f"Sending embed")
                 await self.current_song.channel_where_requested.send(
                     embed=self.current_song.create_embed()
                 )
 
                 await self.play_next_song_event.wait()
-        except Exception as e:
-            print("PRINTING EXCEPTION: ", traceback.format_exc())
+        except Exception:
+            logger.exception("Audio player stopped due to an exception.")
+
+    def prefetch_upcoming_songs(self, current_song: Song) -> None:
+        """Starts refreshing the stream urls of the next songs in the queue, replacing any previous prefetch.
+
+        Args:
+            current_song: The Song object that just started playing.
+        """
+        if self.prefetch_task:
+            self.prefetch_task.cancel()
+        self.prefetch_task = self.event_loop.create_task(
+            self.refresh_upcoming_stream_urls(current_song)
+        )
+
+    async def refresh_upcoming_stream_urls(self, current_song: Song) -> None:
+        """Refreshes the stream urls of the next prefetch_depth songs if they'll expire before they finish playing.
+
+        This runs while the current song plays, so the next songs can start right away. The current song is
+        passed in, since self.current_song is cleared from the voice thread once the song ends.
+
+        Args:
+            current_song: The Song object that just started playing.
+        """
+        seconds_until_played = current_song.ytdl_video_source.duration or 0
+        for song in self.song_queue[: self.config.prefetch_depth]:
+            ytdl_video_source = song.ytdl_video_source
+            # The stream url has to last until the song finishes, not just until it starts
+            if ytdl_video_source.is_stream_url_expiring(
+                seconds_until_played + (ytdl_video_source.duration or 0)
+            ):
+                try:
+                    await self.ytdl_source_factory.process_ytdl_video_source(
+                        ytdl_video_source
+                    )
+                except Exception:
+                    logger.warning("Failed to prefetch song %s", song, exc_info=True)
+            seconds_until_played += ytdl_video_source.duration or 0
 
     async def poll_song_queue(self) -> None:
         """Waits to poll the next song from the song queue and sets the current song."""
-        print("waiting to poll")
         self.current_song = await self.song_queue.get()
 
-    def add_to_song_queue(self, song: Song, play_next: bool = False) -> None:
+    def add_to_song_queue(
+        self, song: Song, play_next: bool = False, after: Optional[Song] = None
+    ) -> None:
         """Adds a song to the song queue.
 
         Args:
             song: The Song object to add to the queue.
             play_next: A boolean indicating whether or not to play the song next or after all the other songs.
+            after: If play_next is True, the Song object to play this song right after, if it's still queued.
         """
-        self.song_queue.put_nowait(song, play_next=play_next)
+        self.song_queue.put_nowait(song, play_next=play_next, after=after)
+
+    def add_songs_to_song_queue(
+        self, songs: Sequence[Song], play_next: bool = False
+    ) -> None:
+        """Adds multiple songs to the song queue, keeping them in the given order.
+
+        Args:
+            songs: The Song objects to add to the queue.
+            play_next: A boolean indicating whether or not to play the songs next or after all the other songs.
+        """
+        self.song_queue.extend_nowait(songs, play_next=play_next)
 
     def remove_from_song_queue(
         self, index: int = None, song_ids: set[str] = None
@@ -181,10 +262,10 @@ class AudioPlayer:
                 None if there was no exception.
         """
         if play_audio_error:
-            print("Error: ", play_audio_error)
+            logger.error("Error while playing audio: %r", play_audio_error)
             raise AudioError(str(play_audio_error))
 
-        print("Song is done, preparing to play next song.")
+        logger.debug("Song is done, preparing to play next song.")
 
         # Record song play to usage database
         asyncio.run_coroutine_threadsafe(
@@ -259,6 +340,7 @@ class AudioPlayer:
             True if the bot successfully leaves the voice channel; False if the bot
                 wasn't in a voice channel to begin with.
         """
+        self.cancel_tasks()
         if self.voice_client:
             await self.stop()
             await self.voice_client.disconnect()
@@ -266,13 +348,25 @@ class AudioPlayer:
             return True
         return False
 
+    def cancel_tasks(self) -> None:
+        """Cancels the audio player and prefetch tasks.
+
+        The audio player task isn't cancelled if it's the one calling this, e.g., when leaving due to inactivity,
+        since it returns on its own right after.
+        """
+        if self.prefetch_task:
+            self.prefetch_task.cancel()
+            self.prefetch_task = None
+        if (
+            self.audio_player_task
+            and self.audio_player_task is not asyncio.current_task()
+        ):
+            self.audio_player_task.cancel()
+            self.audio_player_task = None
+
     async def record_song_play_to_db(self, song: Song) -> None:
         """Records a song play in the usage database."""
-        print("Entered record_song_play_to_db().")
         if self.config.enable_usage_database:
-            print("Recording stats, so we can record this song play.")
             song.record_stop()
-            print("Finished recording song stop.")
             song_play = song.create_song_play()
-            print(f"Created song play in record_song_play_to_db(): {song_play!r}")
-            await self.usage_db.insert_data(song_play)
+            self.usage_db.queue_data(song_play)
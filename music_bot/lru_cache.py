@@ -0,0 +1,71 @@
+"""Contains class LruCache to cache recently used data in memory."""
+
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Generic, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LruCache(Generic[K, V]):
+    """A least recently used cache with a max size, where entries can also expire after some time.
+
+    Attributes:
+        max_size: The max number of entries. Once full, the least recently used entry is evicted.
+        ttl: The default number of seconds until an entry expires. If None, entries don't expire.
+        entries: An OrderedDict mapping keys to the time.monotonic() value when the entry expires (or None)
+            and the cached value, ordered from least to most recently used.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None) -> None:
+        self.max_size: int = max_size
+        self.ttl: Optional[float] = ttl
+        self.entries: OrderedDict[K, tuple[Optional[float], V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: K) -> Optional[V]:
+        """Gets a cached value and marks it as the most recently used.
+
+        Args:
+            key: The key of the value.
+
+        Returns:
+            The cached value if present and not expired; otherwise, None.
+        """
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        expiration, value = entry
+        if expiration is not None and time.monotonic() >= expiration:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """Caches a value, evicting the least recently used entry if full.
+
+        Args:
+            key: The key of the value.
+            value: The value to cache.
+            ttl: The number of seconds until the entry expires. Defaults to the cache's ttl.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expiration = time.monotonic() + ttl if ttl is not None else None
+        self.entries[key] = (expiration, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def remove(self, key: K) -> None:
+        """Removes a value from the cache, if present.
+
+        Args:
+            key: The key of the value.
+        """
+        self.entries.pop(key, None)
@@ -1,5 +1,8 @@
 """Contains the MusicBot class, a custom class for the discord music bot."""
 
+import logging
+import logging.handlers
+import queue
 from typing import override
 
 import discord
@@ -9,6 +12,8 @@ from config import Config
 
 from .music_cog import MusicCog
 
+logger = logging.getLogger(__name__)
+
 
 class MusicBot(commands.Bot):
     """A custom class for the music bot.
@@ -31,8 +36,24 @@ class MusicBot(commands.Bot):
 
     @override
     async def on_ready(self):
-        print(f"Logged in as:\n{self.user.name}\n{self.user.id}")
+        logger.info("Logged in as %s (%s).", self.user.name, self.user.id)
 
     @override
     def run(self, **kwargs) -> None:
-        super().run(self.config.discord_token, **kwargs)
+        # Log records are written to stderr by a separate thread, so logging never blocks the event loop
+        log_queue = queue.SimpleQueue()
+        queue_listener = logging.handlers.QueueListener(
+            log_queue, logging.StreamHandler()
+        )
+        queue_listener.start()
+        try:
+            # Also set up logging for the music bot's modules, not just discord.py
+            super().run(
+                self.config.discord_token,
+                log_handler=logging.handlers.QueueHandler(log_queue),
+                log_level=logging.getLevelNamesMapping()[self.config.log_level.upper()],
+                root_logger=True,
+                **kwargs,
+            )
+        finally:
+            queue_listener.stop()
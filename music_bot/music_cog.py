@@ -2,8 +2,7 @@
 which contains the main logic for the music bot's behavior."""
 
 import asyncio
-import time
-import traceback
+import logging
 from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import override
 
@@ -20,15 +19,17 @@ from .spotify import SpotifyClientWrapper
 from .stats import StatsFactory
 from .usage_database import UsageDatabase
 from .utils import (
+    MusicArgsType,
+    classify_music_args,
     extract_discord_user_id,
     is_int,
-    is_spotify_album_or_playlist,
     is_spotify_track,
-    is_yt_playlist,
     is_yt_video,
 )
 from .ytdl_source import YtdlSourceFactory
 
+logger = logging.getLogger(__name__)
+
 
 class MusicCog(commands.Cog):
     """A custom discord commands cog for the music bot.
@@ -38,7 +39,7 @@ class MusicCog(commands.Cog):
     Attributes:
         config: A Config object representing the configuration of the music bot.
         bot: The commands.Bot object representing the music bot itself.
-        executor: concurrent.futures.Executor object, used to execute yt-dlp and spotify calls that would otherwise
+        executor: concurrent.futures.Executor object, used to execute yt-dlp calls that would otherwise
             block the asyncio event loop. Will be a ProcessPoolExecutor object if config.enable_multiprocessing
             is True, otherwise will be a ThreadPoolExecutor.
         ytdl_source_factory: YtdlSourceFactory object used to create and process YtdlSource objects
@@ -68,11 +69,9 @@ class MusicCog(commands.Cog):
             UsageDatabase(config) if config.enable_usage_database else None
         )
         self.ytdl_source_factory: YtdlSourceFactory = YtdlSourceFactory(
-            config, self.executor
-        )
-        self.spotify_client_wrapper: SpotifyClientWrapper = SpotifyClientWrapper(
-            config, self.executor
+            config, self.executor, self.usage_db
         )
+        self.spotify_client_wrapper: SpotifyClientWrapper = SpotifyClientWrapper(config)
         self.song_factory: SongFactory = SongFactory(
             config, self.ytdl_source_factory, self.spotify_client_wrapper
         )
@@ -101,13 +100,20 @@ class MusicCog(commands.Cog):
     async def cog_load(self):
         if self.config.enable_usage_database:
             await self.usage_db.initialize()
-        print("booting up")
+        logger.info("Music cog loaded.")
 
     @override
     async def cog_unload(self):
         self.executor.shutdown(wait=False)
+        self.spotify_client_wrapper.close()
         tasks = [audio_player.leave() for audio_player in self.audio_players.values()]
-        await asyncio.gather(*tasks)
+        # One audio player failing to leave shouldn't stop the others or the cleanup below
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Failed to leave voice channel.", exc_info=result)
+        if self.config.enable_usage_database:
+            await self.usage_db.close()
 
     @override
     def cog_check(self, ctx: commands.Context):
@@ -119,26 +125,18 @@ class MusicCog(commands.Cog):
 
     @override
     async def cog_before_invoke(self, ctx):
-        print("Starting the cog")
         ctx.audio_player = self.get_audio_player(ctx.guild.id)
-        print(ctx.audio_player)
-        return
 
     @override
     async def cog_after_invoke(self, ctx):
-        print("Stopping the cog")
-        try:
-            if (
-                ctx.audio_player
-                and ctx.audio_player.audio_player_task
-                and ctx.audio_player.audio_player_task.done()
-            ):
-                print(
-                    f"Exception in audio player: {ctx.audio_player.audio_player_task.exception()}"
-                )
-        except asyncio.CancelledError as e:
-            print(type(e))
-            print("Task was cancelled: ", str(e))
+        audio_player_task = ctx.audio_player and ctx.audio_player.audio_player_task
+        if (
+            audio_player_task
+            and audio_player_task.done()
+            and not audio_player_task.cancelled()
+            and (e := audio_player_task.exception())
+        ):
+            logger.error("Exception in audio player.", exc_info=e)
 
         await ctx.message.add_reaction(
             self.reactions.get(ctx.command.name, self.default_reaction)
@@ -154,17 +152,16 @@ class MusicCog(commands.Cog):
             The AudioPlayer object for that guild, freshly created if it didn't already exist.
         """
         audio_player = self.audio_players.get(guild_id)
-        if audio_player:
-            print("Retrieved audio player")
         if not audio_player:
-            audio_player = AudioPlayer(self.config, self.usage_db)
+            audio_player = AudioPlayer(
+                self.config, self.usage_db, self.ytdl_source_factory
+            )
             self.audio_players[guild_id] = audio_player
-            print(f"Stored audio player: {audio_player}")
+            logger.debug("Created audio player for guild %s.", guild_id)
         return audio_player
 
     @override
     async def cog_command_error(self, ctx: commands.Context, error: Exception):
-        print(type(error))
         if isinstance(error, commands.CommandNotFound):
             await ctx.send(
                 'Command not found. Type "-help" to see the list of valid commands.'
@@ -184,7 +181,7 @@ class MusicCog(commands.Cog):
                 f"An unexpected error occurred in {ctx.command.name}: {str(error)}"
             )
 
-        traceback.print_exception(error)
+        logger.error("Error in command %s.", ctx.command, exc_info=error)
 
     @commands.command(name="clear")
     async def clear(self, ctx: commands.Context):
@@ -228,8 +225,6 @@ class MusicCog(commands.Cog):
         ):
             ctx.audio_player.start_audio_player()
 
-        print(ctx.audio_player.voice_client)
-
     @commands.command(name="leave", aliases=["disconnect", "die"])
     async def leave(self, ctx: commands.Context):
         """Completely stops the audio player and leaves the voice channel."""
@@ -346,25 +341,29 @@ class MusicCog(commands.Cog):
                 index += 1
 
         if len(args) > index:
-            if is_spotify_album_or_playlist(args[index]):
+            music_args_type = classify_music_args(args[index])
+            if music_args_type == MusicArgsType.SPOTIFY_COLLECTION:
                 return await ctx.send(
                     "Can only retrieve stats for a Spotify track, not an album or playlist."
                 )
-            elif is_yt_playlist(args[index]) and not is_yt_video(args[index]):
+            # Urls for a video in a playlist are classified as playlists, but get stats for the video
+            elif music_args_type == MusicArgsType.YT_PLAYLIST and not is_yt_video(
+                args[index]
+            ):
                 return await ctx.send(
                     "Can only retrieve stats for a YouTube video, not a YouTube playlist."
                 )
-            elif is_spotify_track(args[index]):
+            elif music_args_type == MusicArgsType.SPOTIFY_TRACK:
                 create_stats_kwargs["spotify_args"] = args[index]
                 create_stats_kwargs["is_yt_search"] = True
-            elif is_yt_video(args[index]):
+            elif music_args_type in (MusicArgsType.YT_VIDEO, MusicArgsType.YT_PLAYLIST):
                 create_stats_kwargs["ytdl_args"] = args[index]
                 create_stats_kwargs["is_yt_search"] = False
             else:
                 create_stats_kwargs["ytdl_args"] = " ".join(args[index:])
                 create_stats_kwargs["is_yt_search"] = True
 
-        print("create_stats_kwargs: ", create_stats_kwargs)
+        logger.debug("Creating stats with kwargs: %s", create_stats_kwargs)
         async with ctx.typing():
             stats = await self.stats_factory.create_stats(ctx, **create_stats_kwargs)
             await ctx.send(embed=stats.create_main_embed())
@@ -393,7 +392,6 @@ class MusicCog(commands.Cog):
                 ytdl_args, is_yt_search=True
             )
             song_ids = {song.id for song in yt_playlist}
-            print(f"song_ids: {song_ids}")
             removed_song = ctx.audio_player.remove_from_song_queue(song_ids=song_ids)
             if not removed_song:
                 await ctx.send(
@@ -439,21 +437,30 @@ class MusicCog(commands.Cog):
             )
 
         if not ctx.audio_player.voice_client:
-            print("joining voice channel")
             await ctx.invoke(self.join)
         async with ctx.typing():
             # Set command context of song factory
             self.song_factory.ctx = ctx
 
             song, playlist = None, None
-            if is_yt_playlist(args):
+            spotify_track_args_list = args.split()
+            if len(spotify_track_args_list) > 1 and all(
+                is_spotify_track(spotify_track_args)
+                for spotify_track_args in spotify_track_args_list
+            ):
+                await self._play_spotify_tracks(
+                    ctx, spotify_track_args_list, play_next=play_next
+                )
+                return
+            music_args_type = classify_music_args(args)
+            if music_args_type == MusicArgsType.YT_PLAYLIST:
                 playlist = await self.song_factory.create_yt_playlist(args)
-            elif is_spotify_album_or_playlist(args):
+            elif music_args_type == MusicArgsType.SPOTIFY_COLLECTION:
                 playlist = await self.song_factory.create_spotify_collection(args)
-            elif is_spotify_track(args):
+            elif music_args_type == MusicArgsType.SPOTIFY_TRACK:
                 song = await self.song_factory.create_song_from_spotify_track(args)
             else:  # Must be youtube video url or search query
-                is_yt_search = not is_yt_video(args)
+                is_yt_search = music_args_type == MusicArgsType.YT_SEARCH
                 song = await self.song_factory.create_song_from_yt_video(
                     args, is_yt_search=is_yt_search
                 )
@@ -461,10 +468,7 @@ class MusicCog(commands.Cog):
             # Single song
             if song:
                 if self.config.enable_usage_database:
-                    start = time.time()
-                    await self.usage_db.insert_data(song.create_song_request())
-                    end = time.time()
-                    print(f"Inserting song request took {end - start} seconds.")
+                    self.usage_db.queue_data(song.create_song_request())
                 ctx.audio_player.add_to_song_queue(song, play_next=play_next)
                 if play_next:
                     await ctx.send(f"Playing {song} next.")
@@ -474,29 +478,78 @@ class MusicCog(commands.Cog):
                 await ctx.send(embed=playlist.create_embed())
 
                 # Process and add to queue
-                asyncio.get_running_loop().create_task(
-                    self.song_factory.process_playlist(playlist)
-                )
-                for song in playlist:
-                    await song.is_processed_event.wait()
+                skipped_songs = []
+                # Songs played next are each added after the last one, so they stay in playlist order
+                last_song = None
+                async for song in self.song_factory.iter_processed_songs(playlist):
+                    if not song.is_processed:
+                        skipped_songs.append(song)
+                        continue
                     if self.config.enable_usage_database:
-                        start = time.time()
-                        await self.usage_db.insert_data(song.create_song_request())
-                        end = time.time()
-                        print(f"Inserting song request took {end - start} seconds.")
-                    ctx.audio_player.add_to_song_queue(song, play_next=play_next)
+                        self.usage_db.queue_data(song.create_song_request())
+                    ctx.audio_player.add_to_song_queue(
+                        song, play_next=play_next, after=last_song
+                    )
+                    last_song = song
 
                 await ctx.send(
                     f"Finished processing **{playlist.playlist_link_markdown}**. "
                     + "Use `-queue` to see the songs added to the queue."
                 )
+                if skipped_songs:
+                    # Report every song that couldn't be processed in one message
+                    skipped_songs_str = "\n".join(
+                        [
+                            f"**{song.link_markdown}**"
+                            for song in skipped_songs[: self.config.max_displayed_songs]
+                        ]
+                    )
+                    await ctx.send(
+                        f"Skipped {len(skipped_songs)} song{'s' if len(skipped_songs) > 1 else ''} "
+                        + f"that couldn't be found on YouTube:\n{skipped_songs_str}"
+                    )
+
+    async def _play_spotify_tracks(
+        self,
+        ctx: commands.Context,
+        spotify_track_args_list: list[str],
+        play_next: bool = False,
+    ) -> None:
+        """Helper function for playing multiple Spotify tracks from a single command.
+
+        Args:
+            ctx: The discord command context in which a command is being invoked.
+            spotify_track_args_list: A list of strings containing Spotify track urls or uris.
+            play_next: A boolean indicating whether or not to play the songs next
+                or after all the other songs.
+        """
+        songs = await self.song_factory.create_songs_from_spotify_tracks(
+            spotify_track_args_list
+        )
+        processed_songs = [song for song in songs if song.is_processed]
+        if self.config.enable_usage_database:
+            for song in processed_songs:
+                self.usage_db.queue_data(song.create_song_request())
+        ctx.audio_player.add_songs_to_song_queue(processed_songs, play_next=play_next)
+
+        num_songs = len(processed_songs)
+        await ctx.send(
+            f"{'Playing' if play_next else 'Enqueued'} {num_songs} song{'s' if num_songs != 1 else ''}"
+            + f"{' next' if play_next else ''}."
+        )
+        num_skipped_songs = len(spotify_track_args_list) - num_songs
+        if num_skipped_songs:
+            await ctx.send(
+                f"Skipped {num_skipped_songs} track{'s' if num_skipped_songs > 1 else ''} "
+                + "that couldn't be found."
+            )
 
     @commands.command(name="play")
     async def play(self, ctx: commands.Context, *, args: str):
         """Plays a song, or a collection of songs from an album or playlist.
 
         Plays a song (or songs) given a YouTube search query, YouTube video url, YouTube playlist url,
-        or Spotify track, album, or playlist url or uri.
+        or Spotify track, album, or playlist url or uri. Multiple Spotify track urls or uris can be given at once.
         If there are other songs in the queue, the song(s) will be added after them.
         """
         await self._play(ctx, args)
@@ -506,7 +559,7 @@ class MusicCog(commands.Cog):
         """Plays a song, or a collection of songs from an album or playlist.
 
         Plays a song (or songs) given a YouTube search query, YouTube video url, YouTube playlist url,
-        or Spotify track, album, or playlist url or uri.
+        or Spotify track, album, or playlist url or uri. Multiple Spotify track urls or uris can be given at once.
         If there are other tracks in the queue, the song(s) will be prioritized and added before them.
         """
         await self._play(ctx, args, play_next=True)
@@ -35,6 +35,22 @@ class Playlist:
         thumbnail_url: The url of the thumbnail for the playlist.
     """
 
+    __slots__ = (
+        "config",
+        "ctx",
+        "title",
+        "url",
+        "songs",
+        "requester",
+        "playlist_link_markdown",
+        "embed_title",
+        "embed_description",
+        "embed_type",
+        "embed_color",
+        "embed_footer",
+        "embed_fields",
+    )
+
     def __init__(
         self,
         config: Config,
@@ -117,7 +133,9 @@ class SpotifyCollection(Playlist):
         thumbnail_url: The url of the thumbnail for the Spotify album or playlist.
     """
 
-    SPOTIFY_GREEN_RGB = (29, 185, 84)
+    __slots__ = ("spotify_data", "thumbnail_url")
+
+    SPOTIFY_GREEN = discord.Color.from_rgb(29, 185, 84)
 
     def __init__(
         self,
@@ -147,6 +165,8 @@ class SpotifyPlaylist(SpotifyCollection):
             Field names and values are both strings.
     """
 
+    __slots__ = ()
+
     def __init__(
         self,
         config: Config,
@@ -169,7 +189,7 @@ class SpotifyPlaylist(SpotifyCollection):
         self.embed_color: discord.Color = (
             discord.Color.from_str(spotify_data["primary_color"])
             if spotify_data.get("primary_color")
-            else discord.Color.from_rgb(*self.SPOTIFY_GREEN_RGB)
+            else self.SPOTIFY_GREEN
         )
 
 
@@ -183,6 +203,8 @@ class SpotifyAlbum(SpotifyCollection):
             Field names and values are both strings.
     """
 
+    __slots__ = ()
+
     def __init__(
         self,
         config: Config,
@@ -202,9 +224,7 @@ class SpotifyAlbum(SpotifyCollection):
         self.embed_fields["Artist"] = get_link_markdown(
             artist["name"], artist["external_urls"]["spotify"]
         )
-        self.embed_color: discord.Color = discord.Color.from_rgb(
-            *self.SPOTIFY_GREEN_RGB
-        )
+        self.embed_color: discord.Color = self.SPOTIFY_GREEN
 
 
 class YoutubePlaylist(Playlist):
@@ -219,7 +239,9 @@ class YoutubePlaylist(Playlist):
             Field names and values are both strings.
     """
 
-    YOUTUBE_RED_RGB = (255, 0, 0)
+    __slots__ = ("ytdl_playlist_source", "thumbnail_url")
+
+    YOUTUBE_RED = discord.Color.from_rgb(255, 0, 0)
 
     def __init__(
         self,
@@ -236,6 +258,6 @@ class YoutubePlaylist(Playlist):
         self.thumbnail_url: str = ytdl_playlist_source.thumbnail_url
 
         self.embed_title: str = "Processing YouTube playlist:"
-        self.embed_color: discord.Color = discord.Color.from_rgb(*self.YOUTUBE_RED_RGB)
+        self.embed_color: discord.Color = self.YOUTUBE_RED
 
         self.embed_fields["Channel"] = ytdl_playlist_source.uploader_link_markdown
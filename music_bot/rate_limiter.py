@@ -0,0 +1,33 @@
+"""Contains class RateLimiter to space out requests to external services."""
+
+import asyncio
+
+
+class RateLimiter:
+    """A leaky bucket rate limiter that lets requests through at a steady rate.
+
+    Each request waits for its turn, so that requests are spaced out evenly instead of arriving in bursts.
+
+    Attributes:
+        interval: The minimum number of seconds between requests. If 0, requests aren't limited.
+        next_request_time: The event loop time at which the next request is allowed.
+    """
+
+    def __init__(self, requests_per_second: float) -> None:
+        """Initializes the rate limiter.
+
+        Args:
+            requests_per_second: The max number of requests allowed per second. If falsy, requests aren't limited.
+        """
+        self.interval: float = 1 / requests_per_second if requests_per_second else 0
+        self.next_request_time: float = 0
+
+    async def acquire(self) -> None:
+        """Waits until the next request is allowed."""
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        delay = self.next_request_time - now
+        self.next_request_time = max(now, self.next_request_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
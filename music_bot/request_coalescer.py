@@ -0,0 +1,61 @@
+"""Contains class RequestCoalescer to share the results of identical concurrent requests."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestCoalescer:
+    """Collapses identical requests that are in flight at the same time into a single request.
+
+    If a request is made while an identical request is still running, it waits for the running request
+    and shares its result (or exception) instead of making another request to the external service.
+
+    Attributes:
+        in_flight_requests: A dictionary mapping request keys to the asyncio.Futures (or Tasks) of those requests.
+            Futures are removed as soon as they're done, so results are never reused by later requests.
+    """
+
+    def __init__(self) -> None:
+        self.in_flight_requests: dict[Hashable, asyncio.Future] = {}
+
+    async def run(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        """Runs a request, or waits for the identical request that's already running.
+
+        Args:
+            key: A hashable key identifying the request. Requests with equal keys must be interchangeable.
+            func: The coroutine function, or other function returning an awaitable, that makes the request.
+            *args: The arguments to call func with.
+            **kwargs: The keyword arguments to call func with.
+
+        Returns:
+            The result of the request.
+        """
+        future = self.in_flight_requests.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self.in_flight_requests[key] = future
+            future.add_done_callback(lambda _: self.remove_request(key, future))
+        # Cancelling one waiter shouldn't cancel the request for the others
+        return await asyncio.shield(future)
+
+    def remove_request(self, key: Hashable, future: asyncio.Future) -> None:
+        """Removes a finished request, so that later identical requests are made again.
+
+        Args:
+            key: The key identifying the request.
+            future: The finished asyncio.Future of the request.
+        """
+        if self.in_flight_requests.get(key) is future:
+            del self.in_flight_requests[key]
+        # Retrieve the exception so it isn't reported as unhandled if every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
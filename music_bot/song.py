@@ -1,22 +1,24 @@
 """Contains classes Song and SongQueue, which contain logic related to the songs played by the music bot."""
 
 import asyncio
+import functools
 import itertools
-import math
 import random
+import time
 from collections.abc import Sequence
-from datetime import datetime, timedelta
+from contextlib import suppress
+from datetime import datetime
 from typing import Any, Iterator, Optional, override
 
 import discord
-import uuid6
 from discord.abc import Messageable
 from discord.ext.commands import Context
+from uuid6 import uuid7
 
 from config import Config
 
 from .usage_tables import SongPlay, SongRequest
-from .utils import get_link_markdown, utc_to_pacific
+from .utils import get_link_markdown, next_embed_color, utc_to_pacific
 from .ytdl_source import YtdlVideoSource
 
 
@@ -43,25 +45,55 @@ class Song:
             for the song to be a valid audio source, since audio is streamed from YouTube.
         spotify_track_data: A dictionary containing spotify track data for the song. If songs are created from
             spotify tracks, they eventually have to populate and process ytdl_video_source to be streamed.
-        is_processed_event: An asyncio.Event representing if the song has been processed or not.
+        is_processed_event: An asyncio.Event representing if the song is done being processed or not.
             The song has been processed when ytdl_video_source is set and ytdl_video_source.is_processed is True.
-            This must be set for the song to be streamed in discord.
+            This must be set for the song to be streamed in discord. It's also set if processing the song fails,
+            so check is_processed after waiting on it.
         guild: The discord guild where the song was requested.
         requester: The discord member who requested the song.
         channel_where_requested: The discord channel where the song was requested.
         timestamp_requested: Datetime when the song was requested, which is
             when the command to request the song was sent.
         timestamp_played: Datetime when the song was played for the first time.
-        timestamps_started: List of datetime objects when the song was started.
-            This includes initially playing the song and unpausing it.
-        timestamps_stopped: List of datetime objects when the song was stopped.
-            This includes finishing playing the song and pausing it.
+        seconds_played: Float total of seconds the song has been played for, not including
+            the time since it was last started if it's currently playing.
+        timestamp_last_started: The time.monotonic() value from when the song was last started,
+            which includes initially playing the song and unpausing it. None if the song is stopped or paused.
+        embed: The discord.Embed displaying the song, built the first time it's needed and reused afterwards.
+            None until then, and reset when a new YtdlVideoSource is added.
     """
 
+    __slots__ = (
+        "config",
+        "ctx",
+        "is_processed_event",
+        "ytdl_video_source",
+        "spotify_track_data",
+        "title",
+        "id",
+        "url",
+        "link_markdown",
+        "uploader_name",
+        "uploader_url",
+        "uploader_link_markdown",
+        "yt_search_query",
+        "guild",
+        "requester",
+        "channel_where_requested",
+        "timestamp_requested",
+        "timestamp_played",
+        "seconds_played",
+        "timestamp_last_started",
+        "embed",
+    )
+
     FFMPEG_OPTIONS = {
         "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
         "options": "-vn",
     }
+    _ffmpeg_opus_audio = staticmethod(
+        functools.partial(discord.FFmpegOpusAudio, **FFMPEG_OPTIONS)
+    )
 
     def __init__(
         self,
@@ -87,6 +119,7 @@ class Song:
 
         # Song must be processed for it to be added to the queue and played
         self.is_processed_event: asyncio.Event = asyncio.Event()
+        self.embed: Optional[discord.Embed] = None
 
         # Songs are created from YtdlVideoSource objects or Spotify tracks
         # If created from a Spotify track, a YtdlVideoSource is added later, when spotify playlists are processed
@@ -100,8 +133,8 @@ class Song:
         self.channel_where_requested: Messageable = ctx.channel
         self.timestamp_requested: datetime = utc_to_pacific(ctx.message.created_at)
         self.timestamp_played: datetime = None
-        self.timestamps_started: list[datetime] = []
-        self.timestamps_stopped: list[datetime] = []
+        self.seconds_played: float = 0.0
+        self.timestamp_last_started: Optional[float] = None
 
     def add_ytdl_video_source(self, ytdl_video_source: YtdlVideoSource) -> None:
         """Adds YtdlVideoSource to the song.
@@ -123,6 +156,7 @@ class Song:
         self.uploader_name: str = ytdl_video_source.uploader_name
         self.uploader_url: str = ytdl_video_source.uploader_url
         self.uploader_link_markdown: str = ytdl_video_source.uploader_link_markdown
+        self.embed = None
 
         if ytdl_video_source.is_processed:
             self.is_processed_event.set()
@@ -140,94 +174,112 @@ class Song:
         self.ytdl_video_source: YtdlVideoSource = None
         self.spotify_track_data = spotify_track_data
 
-        self.title: str = spotify_track_data.get("name")
-        self.url: str = spotify_track_data["external_urls"]["spotify"]
-        self.link_markdown: str = get_link_markdown(self.title, self.url)
+        title = spotify_track_data.get("name")
+        url = spotify_track_data["external_urls"]["spotify"]
+        self.title: str = title
+        self.url: str = url
+        self.link_markdown: str = get_link_markdown(title, url)
 
         artist = spotify_track_data["artists"][0]
-        self.uploader_name: str = artist.get("name")
-        self.uploader_url: str = artist["external_urls"]["spotify"]
+        uploader_name = artist.get("name")
+        uploader_url = artist["external_urls"]["spotify"]
+        self.uploader_name: str = uploader_name
+        self.uploader_url: str = uploader_url
         self.uploader_link_markdown: str = get_link_markdown(
-            self.uploader_name, self.uploader_url
+            uploader_name, uploader_url
         )
 
-        self.yt_search_query: str = f"{self.uploader_name} - {self.title}"
+        self.yt_search_query: str = f"{uploader_name} - {title}"
 
     @property
-    def audio_source(self) -> discord.FFmpegOpusAudio:
-        """Returns a discord.FFmpegOpusAudio object created from the stream url of ytdl_video_source.
-        Used to stream the song's audio to discord."""
-        return discord.FFmpegOpusAudio(
-            source=self.ytdl_video_source.stream_url, **self.FFMPEG_OPTIONS
-        )
+    def is_processed(self) -> bool:
+        """Checks if the song has been successfully processed, meaning it can be played.
+
+        Returns:
+            True if ytdl_video_source is set and has been processed; otherwise, False.
+        """
+        return bool(self.ytdl_video_source and self.ytdl_video_source.is_processed)
+
+    def create_audio_source(self) -> discord.FFmpegOpusAudio:
+        """Creates a discord.FFmpegOpusAudio object from the stream url of ytdl_video_source.
+        Used to stream the song's audio to discord.
+
+        Each call spawns a new ffmpeg process, so the returned audio source should be played exactly once.
+        Opus streams are passed through by ffmpeg as is, instead of being decoded and re-encoded.
+        """
+        ytdl_video_source = self.ytdl_video_source
+        codec = "opus" if ytdl_video_source.audio_codec == "opus" else None
+        return self._ffmpeg_opus_audio(source=ytdl_video_source.stream_url, codec=codec)
 
     @property
-    def total_time_played(self) -> timedelta:
-        """Returns a timedelta object representing the total time the song has been played."""
-        return sum(
-            [
-                (stop or datetime.now()) - start
-                for start, stop in itertools.zip_longest(
-                    self.timestamps_started, self.timestamps_stopped
-                )
-            ],
-            start=timedelta(),
-        )
+    def total_time_played(self) -> float:
+        """Returns the total time the song has been played, in seconds."""
+        if self.timestamp_last_started is None:
+            return self.seconds_played
+        return self.seconds_played + time.monotonic() - self.timestamp_last_started
 
     def create_song_request(self) -> SongRequest:
         """Creates and returns SongRequest object which is inserted into the request table of the usage database."""
-        song_request_uuid = str(uuid6.uuid7())
-        song_request = SongRequest(
-            uuid=song_request_uuid,
+        return SongRequest(
+            uuid=str(uuid7()),
             timestamp=self.timestamp_requested,
             guild_id=self.guild.id,
             requester_id=self.requester.id,
             song_id=self.id,
         )
-        print(f"Record song request: {song_request!r}")
-        return song_request
 
     def create_song_play(self) -> SongPlay:
         """Creates and returns SongPlay object which is inserted into the play table of the usage database."""
-        song_play_uuid = str(uuid6.uuid7())
-        print("song_play_uuid: ", song_play_uuid)
-        song_play = SongPlay(
-            uuid=song_play_uuid,
+        return SongPlay(
+            uuid=str(uuid7()),
             timestamp=self.timestamp_played,
             guild_id=self.guild.id,
             requester_id=self.requester.id,
             song_id=self.id,
-            duration=self.total_time_played.total_seconds(),
+            duration=self.total_time_played,
         )
-        print(f"Created song play: {song_play!r}")
-        return song_play
 
     def create_embed(self) -> discord.Embed:
-        """Creates a discord.Embed object that will be displayed in a discord channel when the song is played."""
-        return (
-            discord.Embed(
-                title="Now playing:",
-                type="rich",
-                description=self.link_markdown,
-                color=discord.Color.random(),
+        """Creates a discord.Embed object that will be displayed in a discord channel when the song is played.
+
+        None of the embed's contents change while the song is queued or playing, so it's only built once,
+        and a copy is returned so callers can't modify the cached embed.
+
+        Returns:
+            A copy of the song's discord.Embed.
+        """
+        if not self.embed:
+            self.embed = (
+                discord.Embed(
+                    title="Now playing:",
+                    type="rich",
+                    description=self.link_markdown,
+                    color=next_embed_color(),
+                )
+                .add_field(
+                    name="Duration", value=self.ytdl_video_source.formatted_duration
+                )
+                .add_field(name="Requested by", value=self.requester.mention)
+                .add_field(name="Uploader", value=self.uploader_link_markdown)
+                .set_thumbnail(url=self.ytdl_video_source.thumbnail_url)
             )
-            .add_field(name="Duration", value=self.ytdl_video_source.formatted_duration)
-            .add_field(name="Requested by", value=self.requester.mention)
-            .add_field(name="Uploader", value=self.uploader_link_markdown)
-            .set_thumbnail(url=self.ytdl_video_source.thumbnail_url)
-        )
+        return self.embed.copy()
 
     def record_start(self) -> None:
         """Records the song being started or unpaused."""
-        timestamp_last_started = datetime.now()
         if not self.timestamp_played:
-            self.timestamp_played = timestamp_last_started
-        self.timestamps_started.append(timestamp_last_started)
+            self.timestamp_played = datetime.now()
+        if self.timestamp_last_started is None:
+            self.timestamp_last_started = time.monotonic()
 
     def record_stop(self) -> None:
-        """Records the song being stopped or paused."""
-        timestamp_last_stopped = datetime.now()
-        self.timestamps_stopped.append(timestamp_last_stopped)
+        """Records the song being stopped or paused.
+
+        Stopping a song that's already stopped or paused, e.g., skipping a paused song, has no effect.
+        """
+        if self.timestamp_last_started is not None:
+            self.seconds_played += time.monotonic() - self.timestamp_last_started
+            self.timestamp_last_started = None
 
     def __str__(self) -> str:
         return f":notes: **{self.title}** :notes: by **{self.uploader_name}**"
@@ -239,12 +291,17 @@ class SongQueue(asyncio.Queue):
     Attributes:
         config: A Config object representing the configuration of the music bot.
         is_looping: A boolean indicating if the song queue is looping or not.
+        embed_color: The discord.Color used for every embed displaying the song queue.
+        page_cache: A dictionary mapping page numbers to the rendered song queue embed for that page.
+            Cleared whenever the song queue changes.
     """
 
     def __init__(self, config: Config) -> None:
         super().__init__()
         self.config: Config = config
         self.is_looping: bool = False
+        self.embed_color: discord.Color = next_embed_color()
+        self.page_cache: dict[int, discord.Embed] = {}
 
     def flip_is_looping(self) -> None:
         """Flips if the song queue is looping or not."""
@@ -259,26 +316,31 @@ class SongQueue(asyncio.Queue):
                 on the embed.
 
         Returns:
-            A discord.Embed object to be displayed in a discord channel.
+            A copy of the discord.Embed object to be displayed in a discord channel.
         """
-        pages = math.ceil(self.qsize() / self.config.max_displayed_songs)
+        if embed := self.page_cache.get(page):
+            return embed.copy()
 
-        start = (page - 1) * self.config.max_displayed_songs
-        end = start + self.config.max_displayed_songs
+        num_songs = self.qsize()
+        max_displayed_songs = self.config.max_displayed_songs
+        pages = -(-num_songs // max_displayed_songs)
+
+        start = (page - 1) * max_displayed_songs
+        end = start + max_displayed_songs
 
         queue_str = "\n".join(
             [
                 f"`{i}.`  **{song.link_markdown}**"
-                for i, song in enumerate(self[start:end], start=start + 1)
+                for i, song in enumerate(self.iter_slice(start, end), start=start + 1)
             ]
         )
-        embed_title = (
-            f"**Song queue has {self.qsize()} track{'s' if self.qsize() > 1 else ''}**:"
-        )
+        plural = "s" if num_songs != 1 else ""
+        embed_title = f"**Song queue has {num_songs} track{plural}**:"
         embed = discord.Embed(
-            title=embed_title, description=queue_str, color=discord.Color.random()
+            title=embed_title, description=queue_str, color=self.embed_color
         ).set_footer(text=f"Viewing page {page}/{pages}")
-        return embed
+        self.page_cache[page] = embed
+        return embed.copy()
 
     @override
     async def get(self) -> Song:
@@ -297,49 +359,96 @@ class SongQueue(asyncio.Queue):
         Raises:
             asyncio.QueueFull: If the queue is too full to fit the entire sequence of songs.
         """
-        if len(songs) > self._maxsize - self.qsize():
+        num_songs = len(songs)
+        # A maxsize of 0 means the queue is unbounded
+        if self._maxsize and num_songs > self._maxsize - self.qsize():
             raise asyncio.QueueFull
         self._extend(songs, play_next=play_next)
-        self._unfinished_tasks += len(songs)
+        self._unfinished_tasks += num_songs
         self._finished.clear()
         self._wakeup_next(self._getters)
 
     def _extend(self, songs: Sequence[Song], play_next: bool) -> None:
+        self.page_cache.clear()
         if play_next:
-            self._queue.extendleft(songs[::-1])
+            self._queue.extendleft(reversed(songs))
         else:
             self._queue.extend(songs)
 
-    def put_nowait(self, item: Song, play_next: bool = False) -> None:
+    def put_nowait(
+        self, item: Song, play_next: bool = False, after: Optional[Song] = None
+    ) -> None:
         """Adds a song to the queue.
 
         Args:
             songs: The song to add to the queue.
             play_next: Whether to play the song next or after or all the other songs in the queue.
+            after: If play_next is True, the song is played right after this song instead, if it's still queued.
+                Used to play songs next one at a time while keeping them in order.
 
         Raises:
             asyncio.QueueFull: If the queue is full.
         """
         if self.full():
             raise asyncio.QueueFull
-        self._put(item, play_next=play_next)
+        self._put(item, play_next=play_next, after=after)
         self._unfinished_tasks += 1
         self._finished.clear()
         self._wakeup_next(self._getters)
 
     @override
-    def _put(self, item: Song, play_next: bool = False) -> None:
-        if play_next:
-            self._queue.appendleft(item)
-        else:
-            self._queue.append(item)
+    def _get(self) -> Song:
+        self.page_cache.clear()
+        return super()._get()
 
-    def __getitem__(self, item: Song) -> Song:
+    @override
+    def _put(
+        self, item: Song, play_next: bool = False, after: Optional[Song] = None
+    ) -> None:
+        self.page_cache.clear()
+        if not play_next:
+            self._queue.append(item)
+            return
+        if after is not None:
+            # Songs played next are at the front of the queue, so this search is short
+            with suppress(ValueError):
+                self._queue.insert(self._queue.index(after) + 1, item)
+                return
+        self._queue.appendleft(item)
+
+    def __getitem__(self, item: int | slice) -> Song | list[Song]:
         if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
+            if item.step in (None, 1):
+                return list(self.iter_slice(item.start, item.stop))
+            # Stepped slices are rare and usually short, so index each song directly.
+            # Unlike islice, this also handles negative indices and steps
+            return [self._queue[i] for i in range(*item.indices(len(self._queue)))]
         else:
             return self._queue[item]
 
+    def iter_slice(self, start: Optional[int], stop: Optional[int]) -> Iterator[Song]:
+        """Iterates over a contiguous slice of the song queue.
+
+        Slices in the back half of the queue are read from the back of the queue,
+        so that paging through a long queue doesn't walk it from the front every time.
+
+        Args:
+            start: The index of the first song in the slice. Follows the same rules as slice indices.
+            stop: The index after the last song in the slice. Follows the same rules as slice indices.
+
+        Returns:
+            An iterator over the songs in the slice, in queue order.
+        """
+        num_songs = len(self._queue)
+        start, stop, _ = slice(start, stop).indices(num_songs)
+        if start <= num_songs // 2:
+            return itertools.islice(self._queue, start, stop)
+        songs = list(
+            itertools.islice(reversed(self._queue), num_songs - stop, num_songs - start)
+        )
+        songs.reverse()
+        return iter(songs)
+
     def __bool__(self) -> bool:
         return self.qsize() > 0
 
@@ -351,11 +460,17 @@ class SongQueue(asyncio.Queue):
 
     def clear(self) -> None:
         """Clears the queue of all songs."""
+        self.page_cache.clear()
         self._queue.clear()
 
     def shuffle(self) -> None:
         """Randomly shuffles the song queue."""
-        random.shuffle(self._queue)
+        # Shuffling a deque in place indexes into it on every swap, so shuffle a list copy instead
+        self.page_cache.clear()
+        songs = list(self._queue)
+        random.shuffle(songs)
+        self._queue.clear()
+        self._queue.extend(songs)
 
     def remove(self, index: int = None, song_ids: set[str] = None) -> Song:
         """Removes a song from the queue and returns it.
@@ -372,8 +487,15 @@ class SongQueue(asyncio.Queue):
                 (i for i, song in enumerate(self._queue) if song.id in song_ids), None
             )
 
-        if index is not None and index >= 0 and index < self.qsize():
-            song = self._queue[index]
-            del self._queue[index]
-            return song
-        return None
+        if index is None or not 0 <= index < self.qsize():
+            return None
+
+        self.page_cache.clear()
+        # Removing from either end of the deque doesn't need to rotate it
+        if index == 0:
+            return self._queue.popleft()
+        if index == self.qsize() - 1:
+            return self._queue.pop()
+        song = self._queue[index]
+        del self._queue[index]
+        return song
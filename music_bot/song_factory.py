@@ -1,9 +1,15 @@
 """Contains class SongFactory to create Song objects from YouTube and Spotify."""
 
 import asyncio
+import itertools
+import logging
 import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from typing import Any, TypeVar
 
-from discord.ext.commands import Context
+from discord.ext.commands import Context, UserInputError
+from yt_dlp.utils import YoutubeDLError
 
 from config import Config
 
@@ -14,9 +20,15 @@ from .playlist import (
     SpotifyPlaylist,
     YoutubePlaylist,
 )
+from .rate_limiter import RateLimiter
 from .song import Song
 from .spotify import SpotifyClientWrapper
-from .ytdl_source import YtdlSourceFactory
+from .utils import get_backoff_delay, normalize_search_query
+from .ytdl_source import YtdlPlaylistSource, YtdlSourceFactory
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
 
 
 class SongFactory:
@@ -28,6 +40,10 @@ class SongFactory:
             with YouTube data retrieved from yt-dlp.
         spotify_client_wrapper: SpotifyClientWrapper object used to retrieve data from Spotify using spotipy.
         ctx: The discord command context in which a command is being invoked.
+        ytdl_rate_limiter: RateLimiter object used to space out yt-dlp requests when processing songs,
+            to avoid being throttled by YouTube.
+        ytdl_semaphore: asyncio.Semaphore bounding how many songs are processed at once across all playlists,
+            to avoid being throttled by YouTube.
     """
 
     def __init__(
@@ -49,26 +65,109 @@ class SongFactory:
         self.ctx: Context = None
         self.ytdl_source_factory: YtdlSourceFactory = ytdl_source_factory
         self.spotify_client_wrapper: SpotifyClientWrapper = spotify_client_wrapper
+        self.ytdl_rate_limiter: RateLimiter = RateLimiter(
+            config.ytdl_requests_per_second
+        )
+        self.ytdl_semaphore: asyncio.Semaphore = asyncio.Semaphore(
+            config.playlist_concurrency
+        )
 
     async def process_playlist(self, playlist: Playlist) -> None:
         """Processes an existing Playlist, making its songs valid audio sources for the music bot to play in discord.
 
         Processes both YouTube and Spotify playlists (and albums) so that their songs can be played.
-        YouTube and Spotify songs have to be processed differently.
+        YouTube and Spotify songs have to be processed differently. Duplicate songs in the playlist
+        are processed once, and share the result.
 
         Args:
             playlist: The Playlist object to process.
         """
-        start = time.time()
+        start = time.perf_counter()
+        is_spotify_collection = isinstance(playlist, SpotifyCollection)
         process_song_task = (
             self.process_song_from_spotify
-            if isinstance(playlist, SpotifyCollection)
+            if is_spotify_collection
             else self.process_song_from_yt_playlist
         )
-        process_song_tasks = [process_song_task(song) for song in playlist]
-        await asyncio.gather(*process_song_tasks)
-        end = time.time()
-        print(f"Processing the spotify playlist took {end - start} seconds.")
+
+        # Songs that would resolve to the same YouTube video are only processed once
+        songs_by_key: dict[str, list[Song]] = defaultdict(list)
+        for song in playlist:
+            key = (
+                normalize_search_query(song.yt_search_query)
+                if is_spotify_collection
+                else song.url
+            )
+            songs_by_key[key].append(song)
+        duplicates_by_song = {songs[0]: songs[1:] for songs in songs_by_key.values()}
+
+        async def process_song_and_duplicates(song: Song) -> None:
+            try:
+                await process_song_task(song)
+            finally:
+                for duplicate_song in duplicates_by_song[song]:
+                    if song.is_processed:
+                        duplicate_song.add_ytdl_video_source(song.ytdl_video_source)
+                    duplicate_song.is_processed_event.set()
+
+        await self.process_songs(duplicates_by_song, process_song_and_duplicates)
+        logger.debug(
+            "Processed playlist %s in %.3f seconds.",
+            playlist.title,
+            time.perf_counter() - start,
+        )
+
+    async def iter_processed_songs(self, playlist: Playlist) -> AsyncIterator[Song]:
+        """Processes a Playlist, yielding its songs in order as soon as each one is done processing.
+
+        The first songs can be queued and played while the rest of the playlist is still being processed.
+        Songs that fail to be processed are still yielded, so check is_processed on each song.
+
+        Args:
+            playlist: The Playlist object to process.
+
+        Yields:
+            The songs of the playlist, in order, once each one is done processing.
+        """
+        process_playlist_task = asyncio.create_task(self.process_playlist(playlist))
+        try:
+            for song in playlist:
+                await song.is_processed_event.wait()
+                yield song
+            await process_playlist_task
+        finally:
+            # Stop processing the rest of the playlist if iteration stops early
+            if not process_playlist_task.done():
+                process_playlist_task.cancel()
+
+    async def process_songs(
+        self,
+        songs: Iterable[Song],
+        process_song_task: Callable[[Song], Awaitable[None]],
+    ) -> None:
+        """Processes multiple songs concurrently.
+
+        Failures are logged per song. A failed song still has its is_processed_event set,
+        so iter_processed_songs moves past it.
+
+        Args:
+            songs: The Song objects to process.
+            process_song_task: The coroutine function used to process each song.
+        """
+
+        async def process_song(song: Song) -> None:
+            async with self.ytdl_semaphore:
+                try:
+                    await process_song_task(song)
+                except Exception as e:
+                    logger.warning("Failed to process song %s: %r", song.title, e)
+                finally:
+                    song.is_processed_event.set()
+
+        # Failures are handled per song, so the task group only cancels the rest if processing is cancelled
+        async with asyncio.TaskGroup() as task_group:
+            for song in songs:
+                task_group.create_task(process_song(song))
 
     async def create_song_from_spotify_track(self, spotify_track_args: str) -> Song:
         """Creates a Song from a Spotify track url or uri.
@@ -78,25 +177,60 @@ class SongFactory:
 
         Returns:
             The Song object for the Spotify track. It should already be processed and ready to be played.
+
+        Raises:
+            UserInputError: If no Spotify track matches the url or uri.
         """
-        spotify_track_data = await self.spotify_client_wrapper.get_spotify_data(
-            spotify_track_args
+        [spotify_track_data] = await self.spotify_client_wrapper.get_spotify_tracks(
+            [spotify_track_args]
         )
+        if spotify_track_data is None:
+            raise UserInputError(
+                f"Couldn't find a Spotify track for {spotify_track_args}. Please check if the given Spotify url is valid."
+            )
         song = Song(self.config, self.ctx, spotify_track_data=spotify_track_data)
         await self.process_song_from_spotify(song)
         return song
 
+    async def create_songs_from_spotify_tracks(
+        self, spotify_track_args_list: list[str]
+    ) -> list[Song]:
+        """Creates Songs from multiple Spotify track urls or uris.
+
+        The tracks are retrieved from Spotify in batches, rather than one request per track.
+
+        Args:
+            spotify_track_args_list: A list of strings containing the Spotify tracks' urls or uris.
+
+        Returns:
+            A list of the Song objects for the Spotify tracks, in the given order. Tracks that couldn't be
+            found on Spotify are left out. Songs that couldn't be processed have is_processed set to False.
+        """
+        spotify_tracks_data = await self.spotify_client_wrapper.get_spotify_tracks(
+            spotify_track_args_list
+        )
+        songs = [
+            Song(self.config, self.ctx, spotify_track_data=spotify_track_data)
+            for spotify_track_data in spotify_tracks_data
+            if spotify_track_data
+        ]
+        await self.process_songs(songs, self.process_song_from_spotify)
+        return songs
+
     async def process_song_from_spotify(self, song: Song) -> None:
         """Processes an existing Song created from Spotify, making it a valid audio source to be played.
 
         Args:
             song: The Song object to process.
         """
-        ytdl_video_source = await self.ytdl_source_factory.create_ytdl_video_source(
-            song.yt_search_query, is_yt_search=True
+        await self.ytdl_rate_limiter.acquire()
+        ytdl_video_source = await self.retry_ytdl(
+            self.ytdl_source_factory.create_ytdl_video_source,
+            song.yt_search_query,
+            is_yt_search=True,
         )
         song.add_ytdl_video_source(ytdl_video_source)
-        print(f"Finished processing song: {song.id}, {song.title}")
+        logger.debug("Finished processing song: %s, %s", song.id, song.title)
 
     async def process_song_from_yt_playlist(self, song: Song) -> None:
         """Processes an existing song created from  YouTube playlsit, making it a valid audio source to be played.
@@ -104,9 +238,49 @@ class SongFactory:
         Args:
             song: The Song object to process.
         """
-        await self.ytdl_source_factory.process_ytdl_video_source(song.ytdl_video_source)
+        await self.ytdl_rate_limiter.acquire()
+        await self.retry_ytdl(
+            self.ytdl_source_factory.process_ytdl_video_source, song.ytdl_video_source
+        )
         song.is_processed_event.set()
 
+    async def retry_ytdl(
+        self,
+        ytdl_coroutine_function: Callable[..., Awaitable[T]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        """Calls a yt-dlp coroutine function, retrying with exponential backoff if YouTube rate limits the bot.
+
+        Errors other than rate limiting aren't retried. That includes YouTube asking the bot to sign in
+        to confirm it's not a bot, since retrying right away would only make that worse.
+
+        Args:
+            ytdl_coroutine_function: The coroutine function that makes the yt-dlp call.
+            *args: Arguments to pass to the coroutine function.
+            **kwargs: Keyword arguments to pass to the coroutine function.
+
+        Returns:
+            The result of the coroutine function.
+
+        Raises:
+            YoutubeDLError: If the yt-dlp call fails and shouldn't be retried, or runs out of retries.
+        """
+        for attempt in itertools.count():
+            try:
+                return await ytdl_coroutine_function(*args, **kwargs)
+            except YoutubeDLError as e:
+                error_message = str(e)
+                if (
+                    "HTTP Error 429" not in error_message
+                    or "Sign in to confirm" in error_message
+                    or attempt >= self.config.ytdl_max_retries
+                ):
+                    raise
+                delay = get_backoff_delay(attempt)
+                logger.info("Rate limited by YouTube, retrying in %.2f seconds.", delay)
+                await asyncio.sleep(delay)
+
     async def create_spotify_collection(self, spotify_args: str) -> SpotifyCollection:
         """Creates a SpotifyCollection from a Spotify album or playlist url or uri.
 
@@ -116,28 +290,45 @@ class SongFactory:
         Returns:
             The SpotifyCollection object for the Spotify album or playlist.
         """
-        start = time.time()
+        start = time.perf_counter()
         spotify_data = await self.spotify_client_wrapper.get_spotify_data(spotify_args)
-        songs = [
-            Song(
-                self.config,
-                self.ctx,
-                spotify_track_data=(
-                    spotify_track_data["track"]
-                    if "track" in spotify_track_data
-                    else spotify_track_data
-                ),
-            )
+        # Building hundreds of songs and the playlist embed would otherwise block the event loop
+        collection = await asyncio.to_thread(
+            self.build_spotify_collection, spotify_data, self.ctx
+        )
+        logger.debug(
+            "Created spotify collection in %.3f seconds.", time.perf_counter() - start
+        )
+        return collection
+
+    def build_spotify_collection(
+        self, spotify_data: dict[str, Any], ctx: Context
+    ) -> SpotifyCollection:
+        """Builds a SpotifyCollection and its songs from already retrieved Spotify data.
+
+        This does no I/O, but is slow enough for large playlists that it's run in a separate thread.
+
+        Args:
+            spotify_data: A dictionary of data for the Spotify album or playlist.
+            ctx: The discord command context in which a command is being invoked.
+
+        Returns:
+            The SpotifyCollection object for the Spotify album or playlist.
+        """
+        # Playlist items wrap their track, which is None if the track was removed from Spotify
+        spotify_tracks_data = (
+            spotify_track_data.get("track", spotify_track_data)
             for spotify_track_data in spotify_data["tracks"]["items"]
+        )
+        songs = [
+            Song(self.config, ctx, spotify_track_data=spotify_track_data)
+            for spotify_track_data in spotify_tracks_data
+            if spotify_track_data
         ]
 
         if spotify_data.get("type") == "album":
-            collection = SpotifyAlbum(self.config, self.ctx, spotify_data, songs)
-        else:
-            collection = SpotifyPlaylist(self.config, self.ctx, spotify_data, songs)
-        end = time.time()
-        print(f"Created spotify collection in {end - start} seconds.")
-        return collection
+            return SpotifyAlbum(self.config, ctx, spotify_data, songs)
+        return SpotifyPlaylist(self.config, ctx, spotify_data, songs)
 
     async def create_yt_playlist(
         self, ytdl_args: str, is_yt_search: bool = False
@@ -156,12 +347,29 @@ class SongFactory:
                 ytdl_args, is_yt_search=is_yt_search
             )
         )
+        # Like Spotify collections, building hundreds of songs would otherwise block the event loop
+        playlist = await asyncio.to_thread(
+            self.build_yt_playlist, ytdl_playlist_source, self.ctx
+        )
+        return playlist
+
+    def build_yt_playlist(
+        self, ytdl_playlist_source: YtdlPlaylistSource, ctx: Context
+    ) -> YoutubePlaylist:
+        """Builds a YoutubePlaylist and a Song for each video in an already created YtdlPlaylistSource.
+
+        Args:
+            ytdl_playlist_source: The YtdlPlaylistSource object for the YouTube playlist.
+            ctx: The discord command context in which a command is being invoked.
+
+        Returns:
+            The YoutubePlaylist object for the YouTube playlist.
+        """
         songs = [
-            Song(self.config, self.ctx, ytdl_video_source=ytdl_video_source)
+            Song(self.config, ctx, ytdl_video_source=ytdl_video_source)
             for ytdl_video_source in ytdl_playlist_source.video_sources
         ]
-        playlist = YoutubePlaylist(self.config, self.ctx, ytdl_playlist_source, songs)
-        return playlist
+        return YoutubePlaylist(self.config, ctx, ytdl_playlist_source, songs)
 
     async def create_song_from_yt_video(
         self, yt_video_args: str, is_yt_search: bool = False
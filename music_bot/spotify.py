@@ -3,34 +3,114 @@ Contains class to retrieve Spotify data using spotipy.
 """
 
 import asyncio
-import functools
-import math
-import os
+import itertools
+import logging
+import threading
 import time
-from concurrent.futures import Executor
-from typing import Any
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, TypeVar
 
+import requests
 import spotipy
+from requests.adapters import HTTPAdapter
+from spotipy import SpotifyException
 from spotipy.oauth2 import SpotifyClientCredentials
+from urllib3.util import Retry
 
 from config import Config
 
-from .utils import parse_spotify_url_or_uri
+from .lru_cache import LruCache
+from .request_coalescer import RequestCoalescer
+from .utils import (
+    gather_with_concurrency,
+    get_backoff_delay,
+    parse_spotify_url_or_uri,
+)
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Only the track fields used to create songs, which keeps pages of playlist tracks much smaller
+PLAYLIST_ITEMS_FIELDS = "items(track(name,external_urls,artists(name,external_urls)))"
+
+# Server errors are retried by urllib3 in the spotipy client's session. Rate limiting (429) is left out, so that
+# it's retried by SpotifyClientWrapper without blocking a thread, and with the Retry-After header available.
+SPOTIFY_RETRIED_STATUSES = (500, 502, 503, 504)
+
+spotify_thread_local = threading.local()
+
+
+def create_spotify_session() -> requests.Session:
+    """Creates the HTTP session for a spotipy client, which retries server errors but not rate limiting.
+
+    Uses the same retry settings as spotipy's own session, except that urllib3 doesn't respect Retry-After.
+    Otherwise, urllib3 would still retry 429 responses with a Retry-After header (which Spotify always sends),
+    sleeping in the worker thread, and spotipy would raise a SpotifyException without the headers once the
+    retries ran out.
+
+    Returns:
+        The requests Session.
+    """
+    retry = Retry(
+        total=spotipy.Spotify.max_retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=spotipy.Spotify.max_retries,
+        backoff_factor=0.3,
+        status_forcelist=SPOTIFY_RETRIED_STATUSES,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_spotify_client(
+    spotify_client_id: str, spotify_client_secret: str
+) -> spotipy.Spotify:
+    """Gets the spotipy client for the current thread, creating it the first time.
+
+    The client is kept for each thread, so its access token is reused until it's about to expire
+    instead of requesting a new one for every call. spotipy clients share an HTTP session, so they
+    aren't shared between threads.
+
+    Args:
+        spotify_client_id: A string containing a Spotify API client id.
+        spotify_client_secret: A string containing a Spotify API client secret.
+
+    Returns:
+        The spotipy client.
+    """
+    if not hasattr(spotify_thread_local, "sp_client"):
+        creds_mgr = SpotifyClientCredentials(
+            client_id=spotify_client_id,
+            client_secret=spotify_client_secret,
+        )
+        spotify_thread_local.sp_client = spotipy.Spotify(
+            client_credentials_manager=creds_mgr,
+            requests_session=create_spotify_session(),
+        )
+    return spotify_thread_local.sp_client
 
 
 def get_spotify_data(
     spotify_client_id: str,
     spotify_client_secret: str,
     spotify_args: str,
-    track_limit: int = math.inf,
 ) -> dict[str, Any]:
     """Retrieves Spotify data for a track, album, or playlist using spotipy.
 
+    For albums and playlists, only the first page of tracks is included.
+
     Args:
         spotify_client_id: A string containing a Spotify API client id.
         spotify_client_secret: A string containing a Spotify API client secret.
         spotify_args: A string containing a Spotify url or uri to a track, album, or playlist.
-        track_limit: The integer limit on the number of tracks returned for Spotify albums and playlists.
 
     Returns:
         A dictionary of data for the Spotify track, album, or playlist.
@@ -38,56 +118,230 @@ def get_spotify_data(
     Raises:
         SpotifyException: If the Spotify data cannot be retrieved after the maximum amount of tries.
     """
-    print(f"Should be in different process. Process id: {os.getpid()}")
-
-    creds_mgr = SpotifyClientCredentials(
-        client_id=spotify_client_id,
-        client_secret=spotify_client_secret,
-    )
-    sp_client = spotipy.Spotify(client_credentials_manager=creds_mgr)
+    sp_client = get_spotify_client(spotify_client_id, spotify_client_secret)
 
     music_type, spotify_id = parse_spotify_url_or_uri(spotify_args)
     get_data = getattr(sp_client, music_type)
     spotify_data = get_data(spotify_id)
 
-    if "tracks" in spotify_data:
-        curr_page = spotify_data["tracks"]
-        tracks = curr_page["items"]
-        while curr_page.get("next") and len(tracks) < track_limit:
-            curr_page = sp_client.next(curr_page)
-            tracks_to_add = curr_page["items"]
-            if len(tracks) + len(tracks_to_add) > track_limit:
-                end = track_limit - len(tracks)
-                tracks_to_add = tracks_to_add[:end]
-            tracks.extend(tracks_to_add)
-
     return spotify_data
 
 
+def get_spotify_tracks_page(
+    spotify_client_id: str,
+    spotify_client_secret: str,
+    music_type: str,
+    spotify_id: str,
+    offset: int,
+    limit: int,
+) -> dict[str, Any]:
+    """Retrieves a page of tracks from a Spotify album or playlist using spotipy.
+
+    Args:
+        spotify_client_id: A string containing a Spotify API client id.
+        spotify_client_secret: A string containing a Spotify API client secret.
+        music_type: A string containing the type of the Spotify collection, either "album" or "playlist".
+        spotify_id: A string containing the Spotify id of the album or playlist.
+        offset: The index of the first track in the page.
+        limit: The max number of tracks in the page.
+
+    Returns:
+        A dictionary of data for the page of tracks.
+
+    Raises:
+        SpotifyException: If the Spotify data cannot be retrieved after the maximum amount of tries.
+    """
+    sp_client = get_spotify_client(spotify_client_id, spotify_client_secret)
+
+    if music_type == "album":
+        return sp_client.album_tracks(spotify_id, limit=limit, offset=offset)
+    return sp_client.playlist_items(
+        spotify_id, fields=PLAYLIST_ITEMS_FIELDS, limit=limit, offset=offset
+    )
+
+
+def get_spotify_tracks(
+    spotify_client_id: str, spotify_client_secret: str, spotify_track_ids: list[str]
+) -> list[dict[str, Any]]:
+    """Retrieves Spotify data for multiple tracks in a single request using spotipy.
+
+    Args:
+        spotify_client_id: A string containing a Spotify API client id.
+        spotify_client_secret: A string containing a Spotify API client secret.
+        spotify_track_ids: A list of at most 50 Spotify track ids.
+
+    Returns:
+        A list of dictionaries of data for the Spotify tracks, in the same order as the ids.
+        Ids that don't match a track have None instead.
+
+    Raises:
+        SpotifyException: If the Spotify data cannot be retrieved after the maximum amount of tries.
+    """
+    sp_client = get_spotify_client(spotify_client_id, spotify_client_secret)
+    return sp_client.tracks(spotify_track_ids)["tracks"]
+
+
 class SpotifyClientWrapper:
     """Class that wraps usage of the spotipy client to retrieve Spotify data.
 
     Handles all interaction with the Spotify client from spotipy.
 
     Attributes:
+        TRACKS_BATCH_SIZE: The max number of tracks Spotify returns from a single request for multiple tracks.
         config: A Config object representing the configuration of the music bot.
-        executor: An Executor object used to execute the spotify calls.
+        executor: A ThreadPoolExecutor used only to execute the spotify calls.
+        spotify_data_cache: An LruCache mapping (music type, Spotify id) pairs to previously retrieved Spotify data,
+            so repeated requests for the same track, album, or playlist don't hit Spotify again. Entries expire after
+            spotify_cache_ttl seconds, so changes to playlists are eventually picked up.
+        request_coalescer: RequestCoalescer used to share Spotify data between identical requests made at the same time.
+        rate_limited_until: The event loop time until which Spotify has asked the bot to stop making requests.
+            Every Spotify call waits until then, instead of only the call that was rate limited.
     """
 
-    def __init__(self, config: Config, executor: Executor) -> None:
+    TRACKS_BATCH_SIZE = 50
+
+    def __init__(self, config: Config) -> None:
         """Initializes the spotify client wrapper based on the provided config.
 
+        Spotify calls only wait on the network, so they get their own thread pool instead of
+        sharing the yt-dlp executor, where they would wait behind slow yt-dlp calls.
+
         Args:
             config: A Config object representing the configuration of the music bot.
         """
         self.config: Config = config
-        self.executor: Executor = executor
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=config.spotify_thread_pool_workers,
+            thread_name_prefix="spotify",
+        )
+        self.spotify_data_cache: LruCache[tuple[str, str], dict[str, Any]] = LruCache(
+            config.spotify_cache_size, config.spotify_cache_ttl
+        )
+        self.request_coalescer: RequestCoalescer = RequestCoalescer()
+        self.rate_limited_until: float = 0
+
+    def close(self) -> None:
+        """Shuts down the thread pool used for spotify calls."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run_in_executor(self, func: Callable[..., T], *args: Any) -> T:
+        """Runs a blocking spotipy call in the thread pool used for spotify calls.
+
+        Unlike loop.run_in_executor(), the call isn't submitted until this coroutine is awaited,
+        so it can be limited with gather_with_concurrency(). If Spotify rate limits the bot, the call
+        is retried after waiting as long as Spotify asks, without holding a thread while waiting.
+        Other calls made in the meantime also wait, rather than being rate limited again.
+
+        Args:
+            func: The function to call.
+            *args: The arguments to call the function with.
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            SpotifyException: If the call fails and shouldn't be retried, or runs out of retries.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in itertools.count():
+            delay = self.rate_limited_until - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await loop.run_in_executor(self.executor, func, *args)
+            except SpotifyException as e:
+                if e.http_status != 429:
+                    raise
+                # Other calls wait out the rate limit even if this call is out of retries
+                delay = self.get_retry_delay(e, attempt)
+                self.rate_limited_until = max(
+                    self.rate_limited_until, loop.time() + delay
+                )
+                if attempt >= self.config.spotify_max_retries:
+                    raise
+                logger.info("Rate limited by Spotify, retrying in %.2f seconds.", delay)
+
+    @staticmethod
+    def get_retry_delay(e: SpotifyException, attempt: int) -> float:
+        """Gets how long to wait before retrying a rate limited Spotify call.
+
+        Args:
+            e: The SpotifyException raised because of rate limiting.
+            attempt: The number of times the call has been retried already.
+
+        Returns:
+            The number of seconds from the Retry-After header if present; otherwise, an exponential backoff
+            with jitter.
+        """
+        retry_after = e.headers.get("Retry-After") if e.headers else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return get_backoff_delay(attempt)
+
+    def get_cached_spotify_data(
+        self, music_type: str, spotify_id: str
+    ) -> Optional[dict[str, Any]]:
+        """Gets previously retrieved Spotify data for a track, album, or playlist, if cached.
+
+        Args:
+            music_type: A string containing the type of Spotify data, such as "track" or "playlist".
+            spotify_id: A string containing the Spotify id.
+
+        Returns:
+            The cached Spotify data if present and not expired; otherwise, None.
+        """
+        return self.spotify_data_cache.get((music_type, spotify_id))
+
+    def cache_spotify_data(
+        self, music_type: str, spotify_id: str, spotify_data: dict[str, Any]
+    ) -> None:
+        """Caches Spotify data for a track, album, or playlist, evicting the least recently used entry if full.
+
+        Args:
+            music_type: A string containing the type of Spotify data, such as "track" or "playlist".
+            spotify_id: A string containing the Spotify id.
+            spotify_data: A dictionary of data for the Spotify track, album, or playlist.
+        """
+        self.spotify_data_cache.set((music_type, spotify_id), spotify_data)
 
     async def get_spotify_data(self, spotify_args: str):
         """Retrieves Spotify data for a track, album, or playlist using spotipy.
 
+        Cached data is returned if present. If the same data is already being retrieved,
+        waits for it instead of retrieving it again.
+
+        Args:
+            spotify_args: A string containing a Spotify url or uri to a track, album, or playlist.
+
+        Returns:
+            A dictionary of data for the Spotify track, album, or playlist.
+
+        Raises:
+            SpotifyException: If the Spotify data cannot be retrieved after the maximum amount of tries.
+        """
+        music_type, spotify_id = parse_spotify_url_or_uri(spotify_args)
+        if spotify_data := self.get_cached_spotify_data(music_type, spotify_id):
+            return spotify_data
+        return await self.request_coalescer.run(
+            (music_type, spotify_id),
+            self.fetch_spotify_data,
+            spotify_args,
+            music_type,
+            spotify_id,
+        )
+
+    async def fetch_spotify_data(
+        self, spotify_args: str, music_type: str, spotify_id: str
+    ) -> dict[str, Any]:
+        """Retrieves Spotify data for a track, album, or playlist from Spotify, and caches it.
+
+        For albums and playlists, the first page of tracks reveals how many tracks there are,
+        and then the remaining pages are retrieved concurrently.
+
         Args:
             spotify_args: A string containing a Spotify url or uri to a track, album, or playlist.
+            music_type: A string containing the type of Spotify data, such as "track" or "playlist".
+            spotify_id: A string containing the Spotify id.
 
         Returns:
             A dictionary of data for the Spotify track, album, or playlist.
@@ -95,19 +349,142 @@ class SpotifyClientWrapper:
         Raises:
             SpotifyException: If the Spotify data cannot be retrieved after the maximum amount of tries.
         """
-        print(f"Current process id: {os.getpid()}")
-        start = time.time()
+        start = time.perf_counter()
 
-        partial_func = functools.partial(
+        spotify_data = await self.run_in_executor(
             get_spotify_data,
             self.config.spotipy_client_id,
             self.config.spotipy_client_secret,
             spotify_args,
-            self.config.playlist_song_limit,
         )
-        spotify_data = await asyncio.get_running_loop().run_in_executor(
-            self.executor, partial_func
+        is_complete = True
+        if "tracks" in spotify_data:
+            is_complete = await self.get_remaining_tracks(spotify_data)
+        # Collections missing pages aren't cached, so the missing tracks are retrieved next time
+        if is_complete:
+            self.cache_spotify_data(music_type, spotify_id, spotify_data)
+        logger.debug(
+            "Getting spotify data took %.2f seconds.", time.perf_counter() - start
         )
-        end = time.time()
-        print(f"Getting spotify data took {end - start} seconds.")
         return spotify_data
+
+    async def get_remaining_tracks(self, spotify_data: dict[str, Any]) -> bool:
+        """Retrieves the rest of the tracks for a Spotify album or playlist, up to playlist_song_limit.
+
+        Pages are retrieved concurrently, at most spotify_page_concurrency at a time, and their
+        tracks are added to spotify_data in order. A page that can't be retrieved is skipped,
+        so that the rest of the album or playlist can still be played.
+
+        Args:
+            spotify_data: A dictionary of data for the Spotify album or playlist, containing its first page of tracks.
+
+        Returns:
+            True if every page was retrieved; otherwise, False.
+        """
+        first_page = spotify_data["tracks"]
+        tracks = first_page["items"]
+        track_limit = self.config.playlist_song_limit
+        num_tracks = min(first_page["total"], track_limit)
+        page_size = first_page["limit"]
+
+        pages = await gather_with_concurrency(
+            self.config.spotify_page_concurrency,
+            *[
+                self.run_in_executor(
+                    get_spotify_tracks_page,
+                    self.config.spotipy_client_id,
+                    self.config.spotipy_client_secret,
+                    spotify_data["type"],
+                    spotify_data["id"],
+                    offset,
+                    page_size,
+                )
+                for offset in range(len(tracks), num_tracks, page_size)
+            ],
+            return_exceptions=True,
+        )
+        is_complete = True
+        for page in pages:
+            if isinstance(page, Exception):
+                logger.warning(
+                    "Failed to get a page of tracks for Spotify %s %s",
+                    spotify_data["type"],
+                    spotify_data["id"],
+                    exc_info=page,
+                )
+                is_complete = False
+                continue
+            tracks.extend(page["items"])
+        if len(tracks) > track_limit:
+            del tracks[track_limit:]
+        first_page["next"] = None
+        return is_complete
+
+    async def get_spotify_tracks(
+        self, spotify_track_args_list: list[str]
+    ) -> list[dict[str, Any]]:
+        """Retrieves Spotify data for multiple tracks, batching up to 50 tracks per request.
+
+        Batches are retrieved concurrently, which is much faster than retrieving each track separately.
+
+        Args:
+            spotify_track_args_list: A list of strings containing Spotify urls or uris to tracks.
+
+        Returns:
+            A list of dictionaries of data for the Spotify tracks, in the same order as the given tracks.
+            Tracks that couldn't be found or retrieved have None instead.
+
+        Raises:
+            SpotifyException: If every batch of tracks fails to be retrieved, so the caller sees the actual
+                Spotify error instead of only None.
+        """
+        spotify_track_ids = [
+            parse_spotify_url_or_uri(spotify_track_args)[1]
+            for spotify_track_args in spotify_track_args_list
+        ]
+        uncached_track_ids = list(
+            dict.fromkeys(
+                spotify_track_id
+                for spotify_track_id in spotify_track_ids
+                if not self.get_cached_spotify_data("track", spotify_track_id)
+            )
+        )
+
+        batched_track_ids = [
+            uncached_track_ids[i : i + self.TRACKS_BATCH_SIZE]
+            for i in range(0, len(uncached_track_ids), self.TRACKS_BATCH_SIZE)
+        ]
+        batches = await gather_with_concurrency(
+            self.config.spotify_page_concurrency,
+            *[
+                self.run_in_executor(
+                    get_spotify_tracks,
+                    self.config.spotipy_client_id,
+                    self.config.spotipy_client_secret,
+                    track_ids,
+                )
+                for track_ids in batched_track_ids
+            ],
+            return_exceptions=True,
+        )
+        errors = [batch for batch in batches if isinstance(batch, Exception)]
+        if errors and len(errors) == len(batches):
+            raise errors[0]
+        fetched_tracks_data: dict[str, Optional[dict[str, Any]]] = {}
+        for track_ids, batch in zip(batched_track_ids, batches, strict=True):
+            # A failed batch shouldn't fail the tracks from the other batches
+            if isinstance(batch, Exception):
+                logger.warning(
+                    "Failed to get Spotify tracks %s", track_ids, exc_info=batch
+                )
+                continue
+            fetched_tracks_data.update(zip(track_ids, batch, strict=True))
+        for spotify_track_id, spotify_track_data in fetched_tracks_data.items():
+            if spotify_track_data:
+                self.cache_spotify_data("track", spotify_track_id, spotify_track_data)
+
+        return [
+            fetched_tracks_data.get(spotify_track_id)
+            or self.get_cached_spotify_data("track", spotify_track_id)
+            for spotify_track_id in spotify_track_ids
+        ]
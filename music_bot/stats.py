@@ -1,24 +1,30 @@
 """Contains classes to calculate usage statistics from the usage database and display them in discord."""
 
+import asyncio
+import logging
 import os
-from datetime import datetime, timedelta
+from collections.abc import Sequence
+from datetime import datetime
 from typing import Any, Optional
 
 import discord
 import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import numpy as np
 from discord.ext.commands import Context
+from matplotlib.figure import Figure
+from sqlalchemy import Row
 
 from config import Config
 
 from .spotify import SpotifyClientWrapper
 from .usage_database import UsageDatabase
 from .usage_tables import SongRequest
-from .utils import format_datetime, format_time_str
+from .utils import format_datetime, format_time_str, next_embed_color
 from .ytdl_source import YtdlSourceFactory
 
+logger = logging.getLogger(__name__)
+
 
 class Stats:
     """Represents a statistical query.
@@ -52,7 +58,7 @@ class Stats:
     def create_main_embed(self) -> discord.Embed:
         embed = discord.Embed(
             title=self.embed_title,
-            color=discord.Color.random(),
+            color=next_embed_color(),
             description=self.embed_description,
         )
         embed.set_thumbnail(url=self.thumbnail_url)
@@ -73,7 +79,6 @@ class StatsFactory:
 
     Attributes:
         config: A Config object representing the configuration of the music bot.
-        ctx: The discord command context in which a command is being invoked.
         usage_db: UsageDatabase object representing the database tracking usage data for the music bot.
         ytdl_source_factory: YtdlSourceFactory object used to create and process YtdlSource objects
             with YouTube data retrieved from yt-dlp.
@@ -88,13 +93,10 @@ class StatsFactory:
         spotify_client_wrapper: SpotifyClientWrapper,
     ) -> None:
         self.config: Config = config
-        self.ctx: Context = None
         self.usage_db: UsageDatabase = usage_db
         self.ytdl_source_factory: YtdlSourceFactory = ytdl_source_factory
         self.spotify_client_wrapper: SpotifyClientWrapper = spotify_client_wrapper
 
-        self.filter_kwargs: dict[str, Any] = None
-
     async def create_stats(
         self,
         ctx: Context,
@@ -104,9 +106,11 @@ class StatsFactory:
         ytdl_args: Optional[str] = None,
         is_yt_search: bool = False,
     ) -> Stats:
+        # Stats commands can run concurrently, so per-call state is passed around instead of stored on the factory
+        filter_kwargs = {"guild_id": ctx.guild.id}
 
-        self.ctx = ctx
-        self.filter_kwargs = {"guild_id": ctx.guild.id}
+        # Make sure queued usage data is included in the stats
+        await self.usage_db.flush()
 
         if spotify_args:
             spotify_track_data = await self.spotify_client_wrapper.get_spotify_data(
@@ -120,31 +124,32 @@ class StatsFactory:
         ytdl_video_source = None
         if ytdl_args:
             ytdl_video_source = await self.ytdl_source_factory.create_ytdl_video_source(
-                ytdl_args, is_yt_search=is_yt_search
+                ytdl_args, is_yt_search=is_yt_search, needs_stream_url=False
             )
 
         if user:
-            self.filter_kwargs["requester_id"] = user.id
+            filter_kwargs["requester_id"] = user.id
         if ytdl_video_source:
-            self.filter_kwargs["song_id"] = ytdl_video_source.id
-
-        stats_dict = {
-            "Requests": await self.usage_db.get_song_request_count(self.filter_kwargs),
-            "Plays": await self.get_num_songs_played(),
-            "Total Time Played": await self.get_total_duration_formatted(),
-            "First Request": await self.get_first_request_formatted(),
-            "Most Recent Request": await self.get_most_recent_request_formatted(),
-        }
+            filter_kwargs["song_id"] = ytdl_video_source.id
 
+        optional_stats = {}
         if not user:
-            stats_dict["Most Frequent Requester"] = (
-                await self.get_most_frequent_requester_formatted()
+            optional_stats["Most Frequent Requester"] = (
+                self.get_most_frequent_requester_formatted(ctx, filter_kwargs)
             )
         if not ytdl_video_source:
-            stats_dict["Most Requested Song"] = (
-                await self.get_most_requested_song_formatted()
+            optional_stats["Most Requested Song"] = (
+                self.get_most_requested_song_formatted(filter_kwargs)
             )
 
+        # None of the stats or the usage graph depend on each other, so get them concurrently
+        stats_dict, figure_filename, *optional_stat_values = await asyncio.gather(
+            self.get_usage_totals_formatted(ctx, filter_kwargs),
+            self.create_figure(filter_kwargs),
+            *optional_stats.values(),
+        )
+        stats_dict.update(zip(optional_stats, optional_stat_values))
+
         if user and ytdl_video_source:
             embed_title = "User/Song Stats:"
             embed_description = f"{user.mention} and {ytdl_video_source.link_markdown}"
@@ -162,144 +167,197 @@ class StatsFactory:
             embed_description = ctx.guild.name
             thumbnail_url = ctx.guild.icon.url
 
-        figure_filename = None
-        if self.config.enable_stats_usage_graph:
-            figure_filename = await self.create_figure()
-
         stats = Stats(
             embed_title, embed_description, thumbnail_url, stats_dict, figure_filename
         )
         return stats
 
-    async def get_num_songs_played(self) -> int:
-        num_songs_played = await self.usage_db.get_song_play_count(self.filter_kwargs)
-        num_songs_played += int(self.is_current_song_relevant())
+    async def get_usage_totals_formatted(
+        self, ctx: Context, filter_kwargs: dict[str, Any]
+    ) -> dict[str, Any]:
+        usage_totals = await self.usage_db.get_usage_totals(filter_kwargs)
+        formatted_first_request, formatted_latest_request = await asyncio.gather(
+            self.format_request(ctx, filter_kwargs, usage_totals.first_request),
+            self.format_request(ctx, filter_kwargs, usage_totals.latest_request),
+        )
+        return {
+            "Requests": usage_totals.request_count,
+            "Plays": self.get_num_songs_played(
+                ctx, filter_kwargs, usage_totals.play_count
+            ),
+            "Total Time Played": self.get_total_duration_formatted(
+                ctx, filter_kwargs, usage_totals.total_play_duration
+            ),
+            "First Request": formatted_first_request,
+            "Most Recent Request": formatted_latest_request,
+        }
+
+    def get_num_songs_played(
+        self, ctx: Context, filter_kwargs: dict[str, Any], num_songs_played: int
+    ) -> int:
+        num_songs_played += int(self.is_current_song_relevant(ctx, filter_kwargs))
         return num_songs_played
 
-    async def get_total_duration_formatted(self) -> int:
-        total_duration = await self.usage_db.get_total_play_duration(self.filter_kwargs)
-        if self.is_current_song_relevant():
-            total_duration += (
-                self.ctx.audio_player.current_song.total_time_played.total_seconds()
-            )
+    def get_total_duration_formatted(
+        self, ctx: Context, filter_kwargs: dict[str, Any], total_duration: float
+    ) -> str:
+        if self.is_current_song_relevant(ctx, filter_kwargs):
+            total_duration += ctx.audio_player.current_song.total_time_played
         formatted_total_duration = format_time_str(total_duration)
         return formatted_total_duration
 
-    def is_current_song_relevant(self) -> bool:
+    @staticmethod
+    def is_current_song_relevant(ctx: Context, filter_kwargs: dict[str, Any]) -> bool:
         return (
-            self.ctx.audio_player
-            and self.ctx.audio_player.is_currently_playing
+            ctx.audio_player
+            and ctx.audio_player.is_currently_playing
             and (
-                "song_id" not in self.filter_kwargs
-                or self.filter_kwargs["song_id"]
-                == self.ctx.audio_player.current_song.id
+                "song_id" not in filter_kwargs
+                or filter_kwargs["song_id"] == ctx.audio_player.current_song.id
             )
         )
 
-    async def get_first_request_formatted(self) -> str:
-        first_request = await self.usage_db.get_first_request(self.filter_kwargs)
-        formatted_first_request = await self.format_request(first_request)
-        return formatted_first_request
-
-    async def get_most_recent_request_formatted(self) -> str:
-        latest_request = await self.usage_db.get_latest_request(self.filter_kwargs)
-        formatted_latest_request = await self.format_request(latest_request)
-        return formatted_latest_request
-
-    async def format_request(self, request: SongRequest) -> str:
+    async def format_request(
+        self, ctx: Context, filter_kwargs: dict[str, Any], request: SongRequest
+    ) -> str:
         if not request:
             return "N/A"
         formatted_request = f"At {format_datetime(request.timestamp)}"
-        if "requester_id" not in self.filter_kwargs:
-            requester = self.ctx.guild.get_member(request.requester_id)
+        if "requester_id" not in filter_kwargs:
+            requester = ctx.guild.get_member(request.requester_id)
             formatted_request += f", by {requester.mention}"
-        if "song_id" not in self.filter_kwargs:
+        if "song_id" not in filter_kwargs:
             ytdl_source = await self.ytdl_source_factory.create_ytdl_video_source(
-                request.song_id
+                request.song_id, needs_stream_url=False
             )
 
             formatted_request += f", requesting {ytdl_source.link_markdown}"
         return formatted_request
 
-    async def get_most_frequent_requester_formatted(self) -> str:
+    async def get_most_frequent_requester_formatted(
+        self, ctx: Context, filter_kwargs: dict[str, Any]
+    ) -> str:
         requester_id, request_count = await self.usage_db.get_most_frequent_requester(
-            self.filter_kwargs
+            filter_kwargs
         )
         if not requester_id or not request_count:
             return "N/A"
-        requester = self.ctx.guild.get_member(requester_id)
+        requester = ctx.guild.get_member(requester_id)
         formatted = f"{requester.mention} with {request_count} request{'s' if request_count > 1 else ''}"
         return formatted
 
-    async def get_most_requested_song_formatted(self) -> str:
+    async def get_most_requested_song_formatted(
+        self, filter_kwargs: dict[str, Any]
+    ) -> str:
         song_id, request_count = await self.usage_db.get_most_requested_song(
-            self.filter_kwargs
+            filter_kwargs
         )
         if not song_id or not request_count:
             return "N/A"
         ytdl_video_source = await self.ytdl_source_factory.create_ytdl_video_source(
-            song_id
+            song_id, needs_stream_url=False
         )
         formatted = f"{ytdl_video_source.link_markdown} with {request_count} request{'s' if request_count > 1 else ''}"
         return formatted
 
-    async def create_figure(self) -> str:
+    async def create_figure(self, filter_kwargs: dict[str, Any]) -> str:
         if not self.config.enable_stats_usage_graph:
             return None
 
         request_counts_raw = await self.usage_db.get_song_request_counts_by_date(
-            self.filter_kwargs
+            filter_kwargs
+        )
+        logger.debug(
+            "Creating usage graph from %d days of requests.", len(request_counts_raw)
         )
-        print(request_counts_raw)
-        print(len(request_counts_raw))
         if not request_counts_raw:
             return None
 
-        request_counts_dict = {row.date: row.count for row in request_counts_raw}
-
         play_counts_raw = await self.usage_db.get_song_play_counts_by_date(
-            self.filter_kwargs
+            filter_kwargs
         )
-        play_counts_dict = {row.date: row.count for row in play_counts_raw}
 
-        start_date, end_date = min(request_counts_dict), max(request_counts_dict)
-        num_days = (end_date - start_date).days
-        dates = [start_date + timedelta(days=i) for i in range(num_days + 1)]
+        request_dates = np.array(
+            [row.date for row in request_counts_raw], dtype="datetime64[D]"
+        )
+        dates = np.arange(
+            request_dates.min(), request_dates.max() + np.timedelta64(1, "D")
+        )
 
-        request_counts = [request_counts_dict.get(date, 0) for date in dates]
-        play_counts = [play_counts_dict.get(date, 0) for date in dates]
+        request_counts = self.fill_counts_by_date(dates, request_counts_raw)
+        play_counts = self.fill_counts_by_date(dates, play_counts_raw)
 
-        print(dates)
-        print(request_counts)
-        print(play_counts)
+        filename = f"usage_figure_{filter_kwargs['guild_id']}_"
+        if "requester_id" in filter_kwargs:
+            filename += f"{filter_kwargs['requester_id']}_"
+        if "song_id" in filter_kwargs:
+            filename += f"{filter_kwargs['song_id']}_"
+        filename += f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')}.png"
+        figure_filename = os.path.join(self.config.figure_dir, filename)
 
-        ax = plt.gca()
+        # Rendering and saving the figure is blocking, so keep it off the event loop
+        await asyncio.to_thread(
+            self.save_figure, figure_filename, dates, request_counts, play_counts
+        )
+
+        return figure_filename
+
+    @staticmethod
+    def fill_counts_by_date(dates: np.ndarray, counts_raw: Sequence[Row]) -> np.ndarray:
+        """Spreads counts grouped by date over a range of dates.
+
+        Args:
+            dates: An array of consecutive dates, with dtype datetime64[D].
+            counts_raw: A list of rows of dates and counts, as returned by the usage database.
+
+        Returns:
+            An array of the count on each date, which is 0 for dates without a row.
+            Rows with dates outside of the range are ignored.
+        """
+        counts = np.zeros(len(dates), dtype=int)
+        if not counts_raw:
+            return counts
+        row_dates = np.array([row.date for row in counts_raw], dtype="datetime64[D]")
+        row_counts = np.array([row.count for row in counts_raw], dtype=int)
+        indices = (row_dates - dates[0]).astype(int)
+        in_range = (indices >= 0) & (indices < len(dates))
+        counts[indices[in_range]] = row_counts[in_range]
+        return counts
+
+    @staticmethod
+    def save_figure(
+        figure_filename: str,
+        dates: np.ndarray,
+        request_counts: np.ndarray,
+        play_counts: np.ndarray,
+    ) -> None:
+        """Draws the usage graph and saves it to a file.
+
+        Uses a standalone Figure rather than pyplot's global state, so it's safe to call from a worker thread
+        and figures don't pile up between calls.
+
+        Args:
+            figure_filename: The path to save the figure to.
+            dates: An array of consecutive dates for the x-axis, with dtype datetime64[D].
+            request_counts: An array of the number of song requests on each date.
+            play_counts: An array of the number of song plays on each date.
+        """
+        fig = Figure()
+        ax = fig.add_subplot()
         ax.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
-        date_interval = max(1, num_days // 8)
+        date_interval = max(1, (len(dates) - 1) // 8)
         ax.xaxis.set_major_locator(mdates.DayLocator(interval=date_interval))
         ax.yaxis.set_major_locator(mticker.MaxNLocator(integer=True))
-        max_count = max(max(request_counts), max(play_counts))
+        max_count = max(request_counts.max(), play_counts.max())
         max_y = ((max_count // 5) + 1) * 5
         y_step = max(1, max_y // 5)
         y_ticks = np.arange(0, max_y, y_step)
-        print(y_ticks)
-        plt.ylim((0, max_y))
-        t = plt.yticks(y_ticks)
-        print(t)
-        plt.plot(dates, request_counts, "bo-")
-        plt.plot(dates, play_counts, "ro-")
-        plt.legend(["Song Requests", "Song Plays"], loc="upper right")
-        plt.title("Usage by Date", y=1.05)
-        plt.xlabel("Date")
-        plt.ylabel("Count")
-
-        filename = f"usage_figure_{self.filter_kwargs['guild_id']}_"
-        if "requester_id" in self.filter_kwargs:
-            filename += f"{self.filter_kwargs['requester_id']}_"
-        if "song_id" in self.filter_kwargs:
-            filename += f"{self.filter_kwargs['song_id']}_"
-        filename += f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')}.png"
-        figure_filename = os.path.join(self.config.figure_dir, filename)
-        plt.savefig(figure_filename, bbox_inches="tight")
-
-        return figure_filename
+        ax.set_ylim((0, max_y))
+        ax.set_yticks(y_ticks)
+        ax.plot(dates, request_counts, "bo-")
+        ax.plot(dates, play_counts, "ro-")
+        ax.legend(["Song Requests", "Song Plays"], loc="upper right")
+        ax.set_title("Usage by Date", y=1.05)
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Count")
+        fig.savefig(figure_filename, bbox_inches="tight")
@@ -1,33 +1,93 @@
 """Contains UsageDatabase class to store and retrieve usage data."""
 
+import asyncio
+import logging
 import os
+from collections import defaultdict
 from collections.abc import Sequence
-from typing import Any, Type
+from datetime import datetime, timedelta
+from typing import Any, Optional
 
-from sqlalchemy import Date, asc, func, select
+from sqlalchemy import Date, Insert, asc, desc, event, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import aliased, sessionmaker
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 
 from config import Config
 
-from .usage_tables import Base, SongPlay, SongRequest
+from .usage_tables import Base, SongPlay, SongRequest, YtSearchResult
+
+logger = logging.getLogger(__name__)
+
+
+class UsageTotals:
+    """Represents the aggregate usage statistics for a filter, queried together.
+
+    Attributes:
+        request_count: The number of song requests.
+        play_count: The number of song plays.
+        total_play_duration: The total number of seconds songs were played for.
+        first_request: The earliest SongRequest, or None if there are no requests.
+        latest_request: The most recent SongRequest, or None if there are no requests.
+    """
+
+    def __init__(
+        self,
+        request_count: int,
+        play_count: int,
+        total_play_duration: float,
+        first_request: Optional[SongRequest],
+        latest_request: Optional[SongRequest],
+    ) -> None:
+        self.request_count: int = request_count
+        self.play_count: int = play_count
+        self.total_play_duration: float = total_play_duration
+        self.first_request: Optional[SongRequest] = first_request
+        self.latest_request: Optional[SongRequest] = latest_request
 
 
 class UsageDatabase:
     """Represents the database that tracks usage for the music bot.
 
     Handles all interaction with the async database and has methods to store and retrieve data
-    from it.
+    from it. Usage data is written by a single background task, which batches queued rows
+    into one transaction instead of committing every row separately.
+
+    Attributes:
+        config: A Config object representing the configuration of the music bot.
+        engine: The async SQLAlchemy engine connected to the database.
+        async_session: A sessionmaker that creates async sessions for the database.
+        write_queue: An asyncio.Queue of rows waiting to be written to the database.
+        writer_task: The asyncio.Task that writes queued rows to the database.
     """
 
     def __init__(self, config: Config):
         self.config: Config = config
         connection_string = f"sqlite+aiosqlite:///{config.usage_database_file_path}"
         self.engine = create_async_engine(connection_string)
+        event.listen(self.engine.sync_engine, "connect", self.set_sqlite_pragmas)
         self.async_session: sessionmaker = sessionmaker(
             self.engine, expire_on_commit=False, class_=AsyncSession
         )
+        self.write_queue: asyncio.Queue[Base] = asyncio.Queue()
+        self.writer_task: asyncio.Task = None
+
+    @staticmethod
+    def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        """Configures each new SQLite connection for the music bot's workload.
+
+        Write-ahead logging lets stats and search cache reads run while usage data is being written,
+        and only syncing to disk at checkpoints makes each write transaction much cheaper.
+
+        Args:
+            dbapi_connection: The new DBAPI connection to the database.
+            connection_record: The connection pool's record for the connection. Unused.
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
     async def initialize(self) -> None:
         os.makedirs(self.config.data_dir, exist_ok=True)
@@ -39,11 +99,168 @@ class UsageDatabase:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
 
-    async def insert_data(self, data: Base) -> None:
+        self.writer_task = asyncio.create_task(self.write_queued_data())
+        self.writer_task.add_done_callback(self.log_writer_task_exception)
+
+    @staticmethod
+    def log_writer_task_exception(writer_task: asyncio.Task) -> None:
+        """Logs the exception that stopped the writer task, if any, since nothing awaits the task.
+
+        Args:
+            writer_task: The finished writer task.
+        """
+        if not writer_task.cancelled() and (e := writer_task.exception()):
+            logger.error("Usage database writer task stopped.", exc_info=e)
+
+    async def close(self) -> None:
+        """Writes any queued data, stops the writer task, and closes the database connection."""
+        if self.writer_task:
+            await self.flush()
+            self.writer_task.cancel()
+            self.writer_task = None
+        await self.engine.dispose()
+
+    def queue_data(self, data: Base) -> None:
+        """Queues a row to be written to the database by the writer task.
+
+        Args:
+            data: The row to write, such as a SongRequest or SongPlay.
+        """
+        self.write_queue.put_nowait(data)
+
+    async def flush(self) -> None:
+        """Waits until all queued data has been written to the database.
+
+        Returns right away if the writer task isn't running, since the queued data would never be written.
+        """
+        if not self.writer_task or self.writer_task.done():
+            return
+        await self.write_queue.join()
+
+    async def write_queued_data(self) -> None:
+        """Writes queued data to the database in batches until cancelled.
+
+        After a row is queued, waits up to usage_database_flush_interval seconds for more rows, then
+        writes up to usage_database_batch_size rows in a single transaction. If the batch fails, its rows
+        are written one at a time, so one bad row doesn't lose the rest of the batch.
+        """
+        while True:
+            batch = [await self.write_queue.get()]
+            await asyncio.sleep(self.config.usage_database_flush_interval)
+            while (
+                len(batch) < self.config.usage_database_batch_size
+                and not self.write_queue.empty()
+            ):
+                batch.append(self.write_queue.get_nowait())
+            try:
+                await self.insert_data(batch)
+            except Exception:
+                logger.warning(
+                    "Failed to write %d rows to usage database, retrying them one at a time.",
+                    len(batch),
+                    exc_info=True,
+                )
+                await self.insert_data_separately(batch)
+            finally:
+                for _ in batch:
+                    self.write_queue.task_done()
+
+    async def insert_data_separately(self, data: Sequence[Base]) -> None:
+        """Inserts rows into the database in separate transactions, logging and dropping any row that fails.
+
+        Args:
+            data: The rows to insert, such as SongRequests and SongPlays.
+        """
+        for row in data:
+            try:
+                await self.insert_data([row])
+            except Exception:
+                logger.exception(
+                    "Dropped %s row from usage database: %r",
+                    type(row).__name__,
+                    {
+                        column.key: getattr(row, column.key)
+                        for column in row.__table__.columns
+                    },
+                )
+
+    async def insert_data(self, data: Sequence[Base]) -> None:
+        """Inserts rows into the database in a single transaction.
+
+        Rows are grouped by table and inserted with one executemany INSERT per table,
+        skipping the ORM's per-object bookkeeping. YouTube search results replace any previously
+        saved result for the same search query.
+
+        Args:
+            data: The rows to insert, such as SongRequests and SongPlays.
+        """
+        rows_by_table: dict[type[Base], list[dict[str, Any]]] = defaultdict(list)
+        for row in data:
+            rows_by_table[type(row)].append(
+                {
+                    column.key: getattr(row, column.key)
+                    for column in row.__table__.columns
+                }
+            )
         async with self.async_session() as session:
             async with session.begin():
-                session.add(data)
-                print(f"added data: {data!r}")
+                for table, rows in rows_by_table.items():
+                    await session.execute(self.create_insert_statement(table), rows)
+        logger.debug("Added %d rows to usage database.", len(data))
+
+    @staticmethod
+    def create_insert_statement(table: type[Base]) -> Insert:
+        """Creates the statement to insert rows into a table.
+
+        Args:
+            table: The table to insert rows into.
+
+        Returns:
+            An INSERT statement for the table, which updates existing YouTube search results instead of failing.
+        """
+        if table is not YtSearchResult:
+            return insert(table)
+        statement = sqlite_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[YtSearchResult.search_query],
+            set_={
+                "timestamp": statement.excluded.timestamp,
+                "url": statement.excluded.url,
+            },
+        )
+
+    async def get_yt_search_result(self, search_query: str) -> Optional[YtSearchResult]:
+        """Gets the saved result of a YouTube search query, if it was saved within yt_search_cache_ttl seconds.
+
+        Args:
+            search_query: The normalized YouTube search query.
+
+        Returns:
+            The YtSearchResult for the search query if saved and not expired; otherwise, None.
+        """
+        oldest_timestamp = datetime.now() - timedelta(
+            seconds=self.config.yt_search_cache_ttl
+        )
+        async with self.async_session() as session:
+            statement = select(YtSearchResult).where(
+                YtSearchResult.search_query == search_query,
+                YtSearchResult.timestamp > oldest_timestamp,
+            )
+            return await session.scalar(statement)
+
+    def save_yt_search_url(self, search_query: str, url: str) -> None:
+        """Queues the url of the video found by a YouTube search query to be saved, replacing any previous url.
+
+        The row is written by the writer task along with other usage data, so processing a song doesn't
+        wait on its own transaction, and errors writing it are logged instead of failing the song.
+
+        Args:
+            search_query: The normalized YouTube search query.
+            url: The url of the first video found by the search query.
+        """
+        self.queue_data(
+            YtSearchResult(search_query=search_query, timestamp=datetime.now(), url=url)
+        )
 
     async def get_song_requests(
         self, filter_kwargs: dict[str, Any]
@@ -85,51 +302,47 @@ class UsageDatabase:
             counts = await session.execute(statement)
             return counts.all()
 
-    async def get_song_request_count(self, filter_kwargs: dict[str, Any]) -> int:
-        song_request_count = await self.get_count(SongRequest, filter_kwargs)
-        print("Times requested: ", song_request_count)
-        return song_request_count
+    async def get_usage_totals(self, filter_kwargs: dict[str, Any]) -> UsageTotals:
+        """Gets the counts, total play duration, and first and latest requests for a filter.
 
-    async def get_song_play_count(self, filter_kwargs: dict[str, Any]) -> int:
-        song_play_count = await self.get_count(SongPlay, filter_kwargs)
-        print("Times played: ", song_play_count)
-        return song_play_count
+        The counts and duration are computed by a single query, and everything is queried
+        in one session, rather than checking out a connection for each statistic.
 
-    async def get_count(self, table: type, filter_kwargs: dict[str, Any]) -> int:
-        async with self.async_session() as session:
-            statement = select(func.count(table.uuid)).filter_by(**filter_kwargs)
-            count = await session.scalar(statement)
-            return count or 0
-
-    async def get_first_request(self, filter_kwargs: dict[str, Any]) -> SongRequest:
-        first_request = await self.get_request(func.min, filter_kwargs)
-        return first_request
-
-    async def get_latest_request(self, filter_kwargs: dict[str, Any]) -> SongRequest:
-        latest_request = await self.get_request(func.max, filter_kwargs)
-        return latest_request
-
-    async def get_request(
-        self, agg_func: Type[func.min] | Type[func.max], filter_kwargs: dict[str, Any]
-    ) -> SongRequest:
-        print(filter_kwargs)
+        Args:
+            filter_kwargs: A dictionary of column names and values to filter song requests and plays by.
+
+        Returns:
+            A UsageTotals object containing the statistics.
+        """
         async with self.async_session() as session:
-            timestamp_statement = select(agg_func(SongRequest.timestamp)).filter_by(
-                **filter_kwargs
+            totals_statement = select(
+                select(func.count(SongRequest.uuid))
+                .filter_by(**filter_kwargs)
+                .scalar_subquery(),
+                select(func.count(SongPlay.uuid))
+                .filter_by(**filter_kwargs)
+                .scalar_subquery(),
+                select(func.sum(SongPlay.duration))
+                .filter_by(**filter_kwargs)
+                .scalar_subquery(),
             )
-            request_timestamp = await session.scalar(timestamp_statement)
-            request_statement = select(SongRequest).filter_by(
-                timestamp=request_timestamp, **filter_kwargs
+            request_count, play_count, total_play_duration = (
+                await session.execute(totals_statement)
+            ).one()
+            requests_statement = select(SongRequest).filter_by(**filter_kwargs)
+            first_request = await session.scalar(
+                requests_statement.order_by(asc(SongRequest.timestamp)).limit(1)
+            )
+            latest_request = await session.scalar(
+                requests_statement.order_by(desc(SongRequest.timestamp)).limit(1)
+            )
+            return UsageTotals(
+                request_count or 0,
+                play_count or 0,
+                total_play_duration or 0,
+                first_request,
+                latest_request,
             )
-            result = await session.scalars(request_statement)
-            request = result.first()
-            return request
-
-    async def get_total_play_duration(self, filter_kwargs: dict[str, Any]) -> float:
-        async with self.async_session() as session:
-            statement = select(func.sum(SongPlay.duration)).filter_by(**filter_kwargs)
-            total_play_duration = await session.scalar(statement)
-            return total_play_duration or 0
 
     async def get_most_requested_song(
         self, filter_kwargs: dict[str, Any]
@@ -151,18 +364,17 @@ class UsageDatabase:
         self, id_attribute: InstrumentedAttribute, filter_kwargs: dict[str, Any]
     ) -> tuple[str | int, int]:
         async with self.async_session() as session:
-            request_counts_statement = (
-                select(
-                    id_attribute.label("id"), func.count(id_attribute).label("count")
-                )
+            request_count = func.count(id_attribute).label("count")
+            statement = (
+                select(id_attribute, request_count)
                 .filter_by(**filter_kwargs)
                 .group_by(id_attribute)
+                .order_by(desc(request_count))
+                .limit(1)
             )
-            request_counts = aliased(request_counts_statement.subquery())
-            max_count_statement = select(func.max(request_counts.c.count))
-            max_count = await session.scalar(max_count_statement)
-            most_common_id_statement = select(request_counts.c.uuid).where(
-                request_counts.c.count == max_count
-            )
-            most_common_id = await session.scalar(most_common_id_statement)
+            result = await session.execute(statement)
+            most_common = result.first()
+            if not most_common:
+                return None, 0
+            most_common_id, max_count = most_common
             return most_common_id, max_count
@@ -60,3 +60,25 @@ class SongPlay(Base):
             f"SongPlay(uuid={self.uuid!r}, timestamp={self.timestamp!r}, guild_id={self.guild_id!r},"
             + f" requester_id={self.requester_id!r}, song_id={self.song_id!r}, duration={self.duration!r})"
         )
+
+
+class YtSearchResult(Base):
+    """Represents the video found by a YouTube search, cached so the search doesn't have to be repeated.
+
+    Attributes:
+        search_query: A string containing the normalized YouTube search query. Also the primary key.
+        timestamp: Datetime when the search was made.
+        url: A string containing the url of the first video found by the search.
+    """
+
+    __tablename__ = "yt_search_result"
+
+    search_query: Mapped[str] = mapped_column(primary_key=True)
+    timestamp: Mapped[datetime]
+    url: Mapped[str]
+
+    def __repr__(self) -> str:
+        return (
+            f"YtSearchResult(search_query={self.search_query!r}, timestamp={self.timestamp!r},"
+            + f" url={self.url!r})"
+        )
@@ -1,13 +1,67 @@
 """Contains utility functions used throughout the rest of the source code."""
 
+import asyncio
+import functools
+import itertools
+import random
 import re
+import unicodedata
+from collections.abc import Coroutine
 from contextlib import suppress
 from datetime import datetime, timedelta
+from enum import Enum
 from re import Match
+from typing import Any, TypeVar
 from urllib.parse import parse_qs, urlparse
 
+import discord
 from dateutil import tz
 
+T = TypeVar("T")
+
+# Asyncio
+
+
+async def gather_with_concurrency(
+    limit: int, *coros: Coroutine[Any, Any, T], return_exceptions: bool = False
+) -> list[T | BaseException]:
+    """Runs coroutines concurrently like asyncio.gather(), but with at most limit of them running at once.
+
+    Only coroutines can be limited, since futures and tasks have already started running.
+
+    Args:
+        limit: The max number of coroutines to run at once.
+        *coros: The coroutines to run.
+        return_exceptions: Whether to return exceptions in the results instead of raising the first one,
+            like in asyncio.gather().
+
+    Returns:
+        The results of the coroutines, in the same order as the coroutines.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run_with_semaphore(coro: Coroutine[Any, Any, T]) -> T:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(
+        *[run_with_semaphore(coro) for coro in coros],
+        return_exceptions=return_exceptions,
+    )
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """Gets how long to wait before retrying a rate limited call, using exponential backoff with jitter.
+
+    Args:
+        attempt: The number of times the call has been retried already.
+
+    Returns:
+        The number of seconds to wait before retrying.
+    """
+    return 0.5 * 2**attempt + random.uniform(0, 0.2)
+
+
 # Markdown
 
 
@@ -24,6 +78,60 @@ def get_link_markdown(name: str, url: str):
     return f"[{name}]({url})"
 
 
+# Embeds
+
+EMBED_COLORS = itertools.cycle(
+    [
+        discord.Color(value)
+        for value in (
+            0x1ABC9C,
+            0x2ECC71,
+            0x3498DB,
+            0x9B59B6,
+            0xE91E63,
+            0xF1C40F,
+            0xE67E22,
+            0xE74C3C,
+        )
+    ]
+)
+
+
+def next_embed_color() -> discord.Color:
+    """Returns the next color in a fixed palette of embed colors.
+
+    Cycling through a palette keeps embeds colorful without generating a random color for each one.
+
+    Returns:
+        The next discord.Color in the palette.
+    """
+    return next(EMBED_COLORS)
+
+
+# Search queries
+
+
+def normalize_search_query(search_query: str) -> str:
+    """Normalizes a search query, so that queries differing only in case, whitespace, or Unicode form are treated the same.
+
+    Non-ASCII queries are NFKC normalized, so that equivalent characters (e.g., full-width letters) compare equal.
+    ASCII queries are already in NFKC form, so most queries skip normalization entirely.
+
+    Args:
+        search_query: The search query to normalize.
+
+    Returns:
+        The search query with runs of whitespace collapsed to single spaces, NFKC normalized, and case folded.
+
+    Examples:
+    - "  Rick Astley -  Never Gonna Give You Up " -> "rick astley - never gonna give you up"
+    - "Ｒｉｃｋ Ａｓｔｌｅｙ" -> "rick astley"
+    """
+    if not search_query.isascii():
+        search_query = unicodedata.normalize("NFKC", search_query)
+    return " ".join(search_query.split()).casefold()
+
+
 # Time
 
 TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -64,20 +172,32 @@ def format_time_str(seconds: int, minutes: int = 0, hours: int = 0) -> str:
     Seconds, minutes and hours can all be over 60. The resulting duration string will account for this.
 
     Args:
-        seconds: The seconds of the duration, as an integer. Required.
+        seconds: The seconds of the duration, as an integer. Required. Floats are rounded to the nearest second.
         minutes: The minutes of the duration, as an integer. Optional, defaults to 0.
         hours: The seconds of the duration, as an integer. Optional, defaults to 0.
 
     Returns:
         The total duration as a formatted time string, in the format "HH:MM:SS".
     """
-    if isinstance(seconds, float):
-        seconds = round(seconds)
-    extra_minutes, seconds = divmod(seconds, 60)
-    minutes += extra_minutes
-    extra_hours, minutes = divmod(minutes, 60)
-    hours += extra_hours
-    return f"{str(hours).zfill(2)}:{str(minutes).zfill(2)}:{str(seconds).zfill(2)}"
+    return _format_total_seconds(round(seconds) + minutes * 60 + hours * 3600)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_total_seconds(total_seconds: int) -> str:
+    """Formats a whole number of seconds as a time string formatted like "HH:MM:SS".
+
+    Results are cached, since many songs share the same duration. Only whole seconds are cached,
+    so float totals, such as total play time in stats, don't fill the cache with entries that never repeat.
+
+    Args:
+        total_seconds: The duration in seconds, as an integer.
+
+    Returns:
+        The duration as a formatted time string, in the format "HH:MM:SS".
+    """
+    minutes, seconds = divmod(total_seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
 def format_datetime(timestamp: datetime) -> str:
@@ -119,9 +239,12 @@ def utc_to_pacific(timestamp: datetime) -> datetime:
 # Regex and URL parsing
 
 
+INT_PATTERN = re.compile(r"^(?P<int>-?\d+)$")
+USER_MENTION_PATTERN = re.compile(r"<!?@(?P<user_id>\d+)>")
+
+
 def is_int(possible_int: str):
-    int_pattern = re.compile(r"^(?P<int>-?\d+)$")
-    if match := int_pattern.match(possible_int):
+    if match := INT_PATTERN.match(possible_int):
         num = match.group("int")
         return num
 
@@ -139,26 +262,55 @@ def extract_discord_user_id(user_mention: str) -> Match[str]:
     - <@0123456789012> -> 0123456789012
     - <!@0123456789012> -> 0123456789012
     """
-    user_mention_pattern = re.compile(r"<!?@(?P<user_id>\d+)>")
-    if match := user_mention_pattern.match(user_mention):
+    # Most arguments aren't mentions, so skip the regex for them
+    if not user_mention.startswith("<"):
+        return None
+    if match := USER_MENTION_PATTERN.match(user_mention):
         user_id = match.group("user_id")
         return user_id
 
 
-def is_spotify_album_or_playlist(args: str) -> bool:
-    """Checks if a string is a url or uri for a Spotify album or playlist.
+SPOTIFY_PREFIXES = ("https://open.spotify.com/", "spotify:")
+SPOTIFY_URI_PATTERN = re.compile(
+    r"^spotify:(?P<music_type>track|album|playlist):(?P<id>[a-zA-Z0-9]+)"
+)
+SPOTIFY_URL_PATTERN = re.compile(
+    r"^https:\/\/open.spotify.com\/(?P<music_type>track|album|playlist)\/(?P<id>[a-zA-Z0-9]+)"
+)
+
+
+class MusicArgsType(Enum):
+    """The kinds of music the music bot can play, as determined by the arguments given to play it."""
+
+    SPOTIFY_TRACK = "spotify_track"
+    SPOTIFY_COLLECTION = "spotify_collection"
+    YT_PLAYLIST = "yt_playlist"
+    YT_VIDEO = "yt_video"
+    YT_SEARCH = "yt_search"
+
+
+def classify_music_args(args: str) -> MusicArgsType:
+    """Classifies the arguments given to play music in a single pass.
+
+    Each kind of url is only parsed once, instead of once for every is_* check.
+    YouTube urls for a video in a playlist are classified as playlists.
 
     Args:
-        args: The string to check.
+        args: The url, uri, or search query to classify.
 
     Returns:
-        True if the string is a url or uri for a Spotify album or playlist; otherwise, False.
+        The MusicArgsType of the arguments. Arguments that aren't a Spotify or YouTube url or uri
+        are classified as a YouTube search query.
     """
-    result = parse_spotify_url_or_uri(args)
-    if result:
-        music_type = result[0]
-        return music_type == "album" or music_type == "playlist"
-    return False
+    if spotify_result := parse_spotify_url_or_uri(args):
+        if spotify_result[0] == "track":
+            return MusicArgsType.SPOTIFY_TRACK
+        return MusicArgsType.SPOTIFY_COLLECTION
+    if is_yt_playlist(args):
+        return MusicArgsType.YT_PLAYLIST
+    if is_yt_video(args):
+        return MusicArgsType.YT_VIDEO
+    return MusicArgsType.YT_SEARCH
 
 
 def is_spotify_track(args: str) -> bool:
@@ -177,15 +329,22 @@ def is_spotify_track(args: str) -> bool:
     return False
 
 
+@functools.lru_cache(maxsize=1024)
 def parse_spotify_url_or_uri(args: str) -> tuple[str]:
     """Checks if a string is a url or uri for a Spotify track, album, or playlist.
 
+    Results are cached, since the same arguments are parsed when classifying them and again when retrieving
+    their Spotify data.
+
     Args:
         args: The string to check.
 
     Returns:
         True if the string is a url or uri for a Spotify track, album, or playlist; otherwise, False.
     """
+    # Most arguments are YouTube urls or search queries, so skip the regexes for them
+    if not args.startswith(SPOTIFY_PREFIXES):
+        return None
     if match := regex_match_spotify_url(args):
         return match.groups()
     elif match := regex_match_spotify_uri(args):
@@ -205,10 +364,7 @@ def regex_match_spotify_uri(uri: str) -> Match[str]:
     Examples:
     - spotify:album:5yTx83u3qerZF7GRJu7eFk
     """
-    spotify_uri_pattern = re.compile(
-        r"^spotify:(?P<music_type>track|album|playlist):(?P<id>[a-zA-Z0-9]+)"
-    )
-    return spotify_uri_pattern.match(uri)
+    return SPOTIFY_URI_PATTERN.match(uri)
 
 
 def regex_match_spotify_url(url: str) -> Match[str]:
@@ -226,11 +382,7 @@ def regex_match_spotify_url(url: str) -> Match[str]:
     - https://open.spotify.com/album/643kxxjS5xPkzD4bR9vUn2?si=cuCeyEgYQm-pXKK7679ptQ
     - https://open.spotify.com/playlist/6FkEOJ76LyyajBjOoGvGXT?si=6ba13d149a1b4d1c
     """
-
-    spotify_url_pattern = re.compile(
-        r"^https:\/\/open.spotify.com\/(?P<music_type>track|album|playlist)\/(?P<id>[a-zA-Z0-9]+)"
-    )
-    return spotify_url_pattern.match(url)
+    return SPOTIFY_URL_PATTERN.match(url)
 
 
 def is_yt_video(url: str):
@@ -269,6 +421,7 @@ def yt_video_id_to_url(yt_video_id: str) -> str:
     return "https://www.youtube.com/watch?v=" + yt_video_id
 
 
+@functools.lru_cache(maxsize=1024)
 def yt_url_to_id(yt_url: str, ignore_playlist: bool = True) -> str | None:
     """Converts a YouTube video url to a YouTube video or playlist id.
 
@@ -4,17 +4,30 @@ Contains classes used to retrieve and store YouTube data using yt-dlp.
 
 import asyncio
 import functools
-import os
+import logging
+import threading
 import time
 from concurrent.futures import Executor
-from typing import Any, override
+from datetime import datetime
+from typing import Any, Optional, override
+from urllib.parse import parse_qs, urlparse
 
 from yt_dlp import YoutubeDL
 from yt_dlp.utils import YoutubeDLError
 
 from config import Config
 
-from .utils import format_time_str, get_link_markdown
+from .lru_cache import LruCache
+from .request_coalescer import RequestCoalescer
+from .usage_database import UsageDatabase
+from .utils import (
+    format_time_str,
+    get_link_markdown,
+    normalize_search_query,
+    yt_url_to_id,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class YtdlSource:
@@ -42,6 +55,17 @@ class YtdlSource:
             Ex: "The official video for “Never Gonna Give You Up” by Rick Astley..."
     """
 
+    __slots__ = (
+        "id",
+        "url",
+        "title",
+        "link_markdown",
+        "uploader_name",
+        "uploader_url",
+        "uploader_link_markdown",
+        "description",
+    )
+
     def __init__(self, ytdl_data: dict[str, Any]) -> None:
         """Initializes the instance based on YouTube data retrieved from yt-dlp.
 
@@ -80,11 +104,30 @@ class YtdlVideoSource(YtdlSource):
         formatted_duration: A string containing the duration of the video, in "hh:mm:ss" format. None if not processed.
         stream_url: A string containing the stream url of the video. None if not processed.
             This will be used later to stream audio to discord. None if not processed.
+        stream_url_expiration: The Unix timestamp when the stream url expires, taken from its "expire" parameter.
+            None if not processed or if the stream url doesn't expire.
+        audio_codec: A string containing the audio codec of the stream, such as "opus". None if not processed.
     """
 
+    __slots__ = (
+        "is_processed",
+        "thumbnail_url",
+        "duration",
+        "formatted_duration",
+        "stream_url",
+        "stream_url_expiration",
+        "audio_codec",
+    )
+
     @override
     def __init__(self, ytdl_data: dict[str, Any]) -> None:
         super().__init__(ytdl_data)
+        self.thumbnail_url: str = None
+        self.duration: int = None
+        self.formatted_duration: str = None
+        self.stream_url: str = None
+        self.stream_url_expiration: Optional[int] = None
+        self.audio_codec: Optional[str] = None
 
         # Processed video data from yt-dlp will not have a "_type" key.
         # Unprocessed video data will have a "_type" of "url".
@@ -104,6 +147,28 @@ class YtdlVideoSource(YtdlSource):
         self.duration: int = processed_ytdl_data.get("duration")
         self.formatted_duration: str = format_time_str(self.duration)
         self.stream_url: str = processed_ytdl_data.get("url")
+        expiration = parse_qs(urlparse(self.stream_url).query).get("expire")
+        self.stream_url_expiration: Optional[int] = (
+            int(expiration[0]) if expiration else None
+        )
+        self.audio_codec: Optional[str] = processed_ytdl_data.get("acodec")
+        self.is_processed = True
+
+    def is_stream_url_expiring(self, seconds: float = 0) -> bool:
+        """Checks if the stream url is missing or will expire within the given number of seconds.
+
+        Args:
+            seconds: The number of seconds from now to check for expiration.
+
+        Returns:
+            True if the video isn't processed or its stream url will have expired by then; otherwise, False.
+        """
+        if not self.is_processed:
+            return True
+        return bool(
+            self.stream_url_expiration
+            and time.time() + seconds >= self.stream_url_expiration
+        )
 
 
 class YtdlPlaylistSource(YtdlSource):
@@ -119,6 +184,13 @@ class YtdlPlaylistSource(YtdlSource):
         are_videos_processed: A boolean indicating if the video sources in the playlist have been processed or not.
     """
 
+    __slots__ = (
+        "video_sources",
+        "are_videos_processed",
+        "video_count",
+        "thumbnail_url",
+    )
+
     def __init__(
         self, ytdl_data: dict[str, Any], video_sources: list[YtdlVideoSource]
     ) -> None:
@@ -148,6 +220,50 @@ class YtdlPlaylistSource(YtdlSource):
             self.thumbnail_url: str = None
 
 
+class YtdlErrorLogger:
+    """Logger for yt-dlp that keeps the error messages it reports.
+
+    With "ignoreerrors" set, yt-dlp reports errors instead of raising them, so this is used
+    to find out why extracting data failed.
+
+    Attributes:
+        error_messages: A list of the error messages reported by yt-dlp.
+    """
+
+    def __init__(self) -> None:
+        self.error_messages: list[str] = []
+
+    def debug(self, message: str) -> None:
+        pass
+
+    def warning(self, message: str) -> None:
+        pass
+
+    def error(self, message: str) -> None:
+        self.error_messages.append(message)
+
+
+ytdl_thread_local = threading.local()
+
+
+def get_ytdl() -> tuple[YoutubeDL, YtdlErrorLogger]:
+    """Gets the YoutubeDL object for the current thread, creating it the first time.
+
+    Creating a YoutubeDL object loads all of the extractors and sets up a new HTTP opener, so each
+    executor worker keeps and reuses its own, which also lets it reuse HTTP connections.
+    YoutubeDL objects aren't thread safe, so they aren't shared between threads.
+
+    Returns:
+        A tuple of the YoutubeDL object and the YtdlErrorLogger it reports errors to.
+    """
+    if not hasattr(ytdl_thread_local, "ytdl"):
+        ytdl_thread_local.logger = YtdlErrorLogger()
+        ytdl_thread_local.ytdl = YoutubeDL(
+            {**YtdlSourceFactory.YTDL_OPTIONS, "logger": ytdl_thread_local.logger}
+        )
+    return ytdl_thread_local.ytdl, ytdl_thread_local.logger
+
+
 def get_ytdl_data(*args: tuple, **kwargs: dict[str, Any]) -> dict[str, Any]:
     """Extracts YouTube data using yt-dlp extract_info() method.
 
@@ -157,21 +273,33 @@ def get_ytdl_data(*args: tuple, **kwargs: dict[str, Any]) -> dict[str, Any]:
 
     Returns:
         A dictionary of sanitized YouTube data retrieved from yt-dlp.
+
+    Raises:
+        YoutubeDLError: If yt-dlp couldn't extract any data.
     """
-    print(f"Should be in different process. Process id: {os.getpid()}")
-    ytdl = YoutubeDL(YtdlSourceFactory.YTDL_OPTIONS)
+    ytdl, error_logger = get_ytdl()
+    error_logger.error_messages.clear()
 
     try:
-        print("Extracting info")
-        start = time.time()
+        start = time.perf_counter()
         ytdl_data = ytdl.extract_info(*args, **kwargs)
+        # With "ignoreerrors" set, yt-dlp returns None instead of raising
+        if ytdl_data is None:
+            raise YoutubeDLError(
+                error_logger.error_messages[-1]
+                if error_logger.error_messages
+                else f"Couldn't extract YouTube data for {args[0]}."
+            )
         if "entries" in ytdl_data:
             ytdl_data["entries"] = list(ytdl_data["entries"])
-        end = time.time()
-        time_span = end - start
-        print(f"Are we blocking here in extract_info? It took {time_span} seconds.")
+        logger.debug(
+            "Extracted YouTube data for %s in %.2f seconds.",
+            args[0],
+            time.perf_counter() - start,
+        )
     except YoutubeDLError as e:
-        print(f"Encountered YTDL error: {e}")
+        logger.debug("Encountered yt-dlp error: %s", e)
+        raise
 
     return ytdl.sanitize_info(ytdl_data)
 
@@ -185,15 +313,25 @@ class YtdlSourceFactory:
 
     Attributes:
         config: A Config object representing the configuration of the music bot.
+        executor: An Executor object used to execute the yt-dlp calls.
+        yt_search_cache: An LruCache mapping normalized YouTube search queries to the url of the first video found
+            by the search, so repeated searches can skip YouTube search. Entries expire after yt_search_cache_ttl
+            seconds, so changes to the search results are eventually picked up.
+        usage_db: UsageDatabase object used to save YouTube search results across restarts.
+            None if the usage database isn't enabled.
+        ytdl_video_data_cache: An LruCache mapping YouTube video ids to processed YouTube data for the video,
+            so replaying a video can skip yt-dlp while its stream url is still valid, and stats can show the video
+            without yt-dlp.
+        request_coalescer: RequestCoalescer used to share the results of identical yt-dlp calls made at the same time.
     """
 
+    # Cached video data is only used if its stream url is valid for at least this many seconds
+    MIN_CACHED_STREAM_URL_LIFETIME = 30 * 60
+
     YTDL_OPTIONS = {
-        "format": "bestaudio[acodec=opus]/bestaudio/best",
-        "extractaudio": True,
+        # Itag 251 is YouTube's audio-only webm/opus stream, which discord can play without transcoding
+        "format": "251/bestaudio[acodec=opus]/bestaudio/best",
         "extract_flat": False,
-        "audioformat": "opus",
-        "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
-        "restrictfilenames": True,
         "noplaylist": True,
         "nocheckcertificate": True,
         "ignoreerrors": True,
@@ -205,15 +343,29 @@ class YtdlSourceFactory:
         "skip_download": True,
     }
 
-    def __init__(self, config: Config, executor: Executor) -> None:
+    def __init__(
+        self,
+        config: Config,
+        executor: Executor,
+        usage_db: Optional[UsageDatabase] = None,
+    ) -> None:
         """Initializes the current instance based on the music bot config.
 
         Args:
             config: A Config object representing the configuration of the music bot.
             process_pool_executor: The ProcessPoolExecutor object to run yt-dlp calls with.
+            usage_db: UsageDatabase object used to save YouTube search results across restarts, if enabled.
         """
         self.config: Config = config
         self.executor: Executor = executor
+        self.yt_search_cache: LruCache[str, str] = LruCache(
+            config.yt_search_cache_size, config.yt_search_cache_ttl
+        )
+        self.usage_db: Optional[UsageDatabase] = usage_db
+        self.ytdl_video_data_cache: LruCache[str, dict[str, Any]] = LruCache(
+            config.ytdl_video_cache_size
+        )
+        self.request_coalescer: RequestCoalescer = RequestCoalescer()
 
     async def process_ytdl_video_source(
         self, ytdl_video_source: YtdlVideoSource
@@ -227,9 +379,14 @@ class YtdlSourceFactory:
             ytdl_video_source.url, download=False, process=True
         )
         ytdl_video_source.process(processed_ytdl_data)
+        self.cache_ytdl_video_data(ytdl_video_source.id, processed_ytdl_data)
 
     async def create_ytdl_video_source(
-        self, ytdl_args: str, is_yt_search: bool = False, process: bool = True
+        self,
+        ytdl_args: str,
+        is_yt_search: bool = False,
+        process: bool = True,
+        needs_stream_url: bool = True,
     ) -> YtdlVideoSource:
         """Creates a YtdlVideoSource object based on a YouTube video url or search.
 
@@ -237,21 +394,128 @@ class YtdlSourceFactory:
             ytdl_args: A string containing a YouTube video url or search query.
             is_yt_search: A boolean indicating whether or not ytdl_args is a YouTube search query.
             process: A boolean indicating whether or not to process the created YtdlVideoSource object.
+            needs_stream_url: A boolean indicating whether or not the YtdlVideoSource object will be played.
+                If not, such as when only displaying the video in stats, cached data is used even if its
+                stream url has expired.
 
         Returns:
             The created YtdlVideoSource object.
         """
+        search_query = None
         if is_yt_search:
-            ytdl_args = "ytsearch:" + ytdl_args
-        print(f"Creating ytdl video source with ytdl_args: {ytdl_args}")
+            search_query = ytdl_args
+            cached_url = self.get_cached_yt_search_url(
+                search_query
+            ) or await self.get_saved_yt_search_url(search_query)
+            if cached_url:
+                ytdl_args, is_yt_search = cached_url, False
+            else:
+                ytdl_args = "ytsearch:" + ytdl_args
+        if process and not is_yt_search:
+            ytdl_video_source = self.get_cached_ytdl_video_source(
+                yt_url_to_id(ytdl_args) or ytdl_args, needs_stream_url
+            )
+            if ytdl_video_source:
+                return ytdl_video_source
+        logger.debug("Creating ytdl video source with ytdl_args: %s", ytdl_args)
         ytdl_data = await self.get_ytdl_data(ytdl_args, download=False, process=process)
         if is_yt_search:
-            # if len(ytdl_data["entries"]) == 0:
-            #     print(ytdl_data)
             ytdl_data = ytdl_data["entries"][0]
         ytdl_video_source = YtdlVideoSource(ytdl_data)
+        if process:
+            self.cache_ytdl_video_data(ytdl_video_source.id, ytdl_data)
+        if is_yt_search:
+            self.cache_yt_search_url(search_query, ytdl_video_source.url)
+            if self.usage_db:
+                self.usage_db.save_yt_search_url(
+                    normalize_search_query(search_query), ytdl_video_source.url
+                )
+        return ytdl_video_source
+
+    async def get_saved_yt_search_url(self, search_query: str) -> Optional[str]:
+        """Gets the url of the video found by a YouTube search query from the usage database, if saved.
+
+        Found urls are also added to the in-memory cache, until they would have expired in the database.
+
+        Args:
+            search_query: The YouTube search query.
+
+        Returns:
+            The url of the first video found by the search query if saved and not expired; otherwise, None.
+        """
+        if not self.usage_db:
+            return None
+        yt_search_result = await self.usage_db.get_yt_search_result(
+            normalize_search_query(search_query)
+        )
+        if not yt_search_result:
+            return None
+        age = (datetime.now() - yt_search_result.timestamp).total_seconds()
+        self.cache_yt_search_url(
+            search_query,
+            yt_search_result.url,
+            self.config.yt_search_cache_ttl - age,
+        )
+        return yt_search_result.url
+
+    def get_cached_ytdl_video_source(
+        self, yt_video_id: str, needs_stream_url: bool = True
+    ) -> Optional[YtdlVideoSource]:
+        """Creates a YtdlVideoSource from cached YouTube data for a video, if its stream url is still valid.
+
+        Args:
+            yt_video_id: The YouTube video id.
+            needs_stream_url: A boolean indicating whether or not the stream url has to still be valid.
+
+        Returns:
+            A new processed YtdlVideoSource object if the video's data is cached and its stream url won't expire
+            soon (or isn't needed); otherwise, None.
+        """
+        ytdl_data = self.ytdl_video_data_cache.get(yt_video_id)
+        if not ytdl_data:
+            return None
+        ytdl_video_source = YtdlVideoSource(ytdl_data)
+        if needs_stream_url and ytdl_video_source.is_stream_url_expiring(
+            self.MIN_CACHED_STREAM_URL_LIFETIME
+        ):
+            self.ytdl_video_data_cache.remove(yt_video_id)
+            return None
         return ytdl_video_source
 
+    def cache_ytdl_video_data(
+        self, yt_video_id: str, ytdl_data: dict[str, Any]
+    ) -> None:
+        """Caches processed YouTube data for a video, evicting the least recently used entry if full.
+
+        Args:
+            yt_video_id: The YouTube video id.
+            ytdl_data: A dictionary of processed YouTube data for the video.
+        """
+        self.ytdl_video_data_cache.set(yt_video_id, ytdl_data)
+
+    def get_cached_yt_search_url(self, search_query: str) -> Optional[str]:
+        """Gets the url of the video previously found by a YouTube search query, if cached.
+
+        Args:
+            search_query: The YouTube search query.
+
+        Returns:
+            The url of the first video found by the search query if cached and not expired; otherwise, None.
+        """
+        return self.yt_search_cache.get(normalize_search_query(search_query))
+
+    def cache_yt_search_url(
+        self, search_query: str, url: str, ttl: Optional[float] = None
+    ) -> None:
+        """Caches the url of the video found by a YouTube search query, evicting the least recently used entry if full.
+
+        Args:
+            search_query: The YouTube search query.
+            url: The url of the first video found by the search query.
+            ttl: The number of seconds until the entry expires. Defaults to yt_search_cache_ttl.
+        """
+        self.yt_search_cache.set(normalize_search_query(search_query), url, ttl)
+
     async def create_ytdl_playlist_source(
         self, ytdl_args: str, is_yt_search: bool = False
     ) -> YtdlPlaylistSource:
@@ -267,13 +531,13 @@ class YtdlSourceFactory:
             ytdl_args = (
                 f"ytsearch{self.config.yt_search_playlist_song_limit}:" + ytdl_args
             )
-        print(f"Args: {ytdl_args}")
         ytdl_data = await self.get_ytdl_data(ytdl_args, download=False, process=False)
-        print("ytdl_data: ", ytdl_data)
-        print("type of ytdl_data: ", type(ytdl_data))
         entries = list(ytdl_data["entries"])
-        print(entries)
-        print(type(entries))
+        logger.debug(
+            "Created ytdl playlist source with ytdl_args: %s, %d entries",
+            ytdl_args,
+            len(entries),
+        )
         ytdl_video_sources = [YtdlVideoSource(entry) for entry in entries]
         ytdl_playlist_source = YtdlPlaylistSource(ytdl_data, ytdl_video_sources)
         return ytdl_playlist_source
@@ -285,11 +549,15 @@ class YtdlSourceFactory:
         or None, prompting use of the default ThreadPoolExecutor. The executor used depends on
         if multiprocessing is enabled in the config.
 
+        Identical calls made while one is already running share its result instead of calling yt-dlp again.
+
         Returns:
             A sanitized dictionary of YouTube data retrieved from yt-dlp.
         """
         partial_func = functools.partial(get_ytdl_data, *args, **kwargs)
-        ytdl_data = await asyncio.get_running_loop().run_in_executor(
-            self.executor, partial_func
+        return await self.request_coalescer.run(
+            (args, tuple(sorted(kwargs.items()))),
+            asyncio.get_running_loop().run_in_executor,
+            self.executor,
+            partial_func,
         )
-        return ytdl_data
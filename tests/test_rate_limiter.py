@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from music_bot.rate_limiter import RateLimiter
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_requests_are_spaced_out(self) -> None:
+        rate_limiter = RateLimiter(requests_per_second=4)
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            await asyncio.gather(*[rate_limiter.acquire() for _ in range(3)])
+
+        # The first request goes through right away, and each later one waits a quarter second longer
+        delays = [call.args[0] for call in sleep.await_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertAlmostEqual(delays[0], 0.25, places=2)
+        self.assertAlmostEqual(delays[1], 0.5, places=2)
+
+    async def test_requests_after_the_interval_do_not_wait(self) -> None:
+        rate_limiter = RateLimiter(requests_per_second=4)
+        loop = asyncio.get_running_loop()
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            await rate_limiter.acquire()
+            rate_limiter.next_request_time = loop.time() - 1
+            await rate_limiter.acquire()
+
+        sleep.assert_not_awaited()
+
+    async def test_no_limit(self) -> None:
+        rate_limiter = RateLimiter(requests_per_second=0)
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            for _ in range(3):
+                await rate_limiter.acquire()
+
+        sleep.assert_not_awaited()
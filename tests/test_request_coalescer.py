@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+from music_bot.request_coalescer import RequestCoalescer
+
+
+class TestRequestCoalescer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.request_coalescer = RequestCoalescer()
+        self.call_count = 0
+        self.release = asyncio.Event()
+
+    async def request(self, value: str) -> str:
+        self.call_count += 1
+        await self.release.wait()
+        return value
+
+    async def test_concurrent_callers_share_one_request(self) -> None:
+        tasks = [
+            asyncio.create_task(self.request_coalescer.run("key", self.request, "a"))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await asyncio.gather(*tasks), ["a", "a", "a"])
+        self.assertEqual(self.call_count, 1)
+        self.assertFalse(self.request_coalescer.in_flight_requests)
+
+    async def test_different_keys_make_separate_requests(self) -> None:
+        self.release.set()
+        results = await asyncio.gather(
+            self.request_coalescer.run("a", self.request, "a"),
+            self.request_coalescer.run("b", self.request, "b"),
+        )
+
+        self.assertEqual(results, ["a", "b"])
+        self.assertEqual(self.call_count, 2)
+
+    async def test_finished_requests_are_made_again(self) -> None:
+        self.release.set()
+        await self.request_coalescer.run("key", self.request, "a")
+        await self.request_coalescer.run("key", self.request, "a")
+
+        self.assertEqual(self.call_count, 2)
+
+    async def test_cancelling_one_caller_does_not_cancel_the_others(self) -> None:
+        cancelled_task = asyncio.create_task(
+            self.request_coalescer.run("key", self.request, "a")
+        )
+        task = asyncio.create_task(self.request_coalescer.run("key", self.request, "a"))
+        await asyncio.sleep(0)
+
+        cancelled_task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled_task
+        self.release.set()
+
+        self.assertEqual(await task, "a")
+        self.assertEqual(self.call_count, 1)
+
+    async def test_exceptions_are_shared(self) -> None:
+        async def failing_request() -> None:
+            self.call_count += 1
+            await self.release.wait()
+            raise ValueError("failed")
+
+        tasks = [
+            asyncio.create_task(self.request_coalescer.run("key", failing_request))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(self.call_count, 1)
@@ -0,0 +1,67 @@
+import unittest
+from types import SimpleNamespace
+
+from music_bot.song import SongQueue
+
+
+class TestSongQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.song_queue = SongQueue(SimpleNamespace(max_displayed_songs=10))
+        self.song_queue.extend_nowait(["a", "b", "c"])
+
+    def test_put_appends(self) -> None:
+        self.song_queue.put_nowait("d")
+
+        self.assertEqual(list(self.song_queue), ["a", "b", "c", "d"])
+
+    def test_put_play_next(self) -> None:
+        self.song_queue.put_nowait("d", play_next=True)
+
+        self.assertEqual(list(self.song_queue), ["d", "a", "b", "c"])
+
+    def test_put_play_next_after_keeps_songs_in_order(self) -> None:
+        # Songs from a playlist played next are each queued after the previous one
+        last_song = None
+        for song in ["d", "e", "f"]:
+            self.song_queue.put_nowait(song, play_next=True, after=last_song)
+            last_song = song
+
+        self.assertEqual(list(self.song_queue), ["d", "e", "f", "a", "b", "c"])
+
+    async def test_put_play_next_after_played_song(self) -> None:
+        self.song_queue.put_nowait("d", play_next=True)
+        await self.song_queue.get()
+        self.song_queue.put_nowait("e", play_next=True, after="d")
+
+        self.assertEqual(list(self.song_queue), ["e", "a", "b", "c"])
+
+    def test_extend_play_next(self) -> None:
+        self.song_queue.extend_nowait(["d", "e"], play_next=True)
+
+        self.assertEqual(list(self.song_queue), ["d", "e", "a", "b", "c"])
+        self.assertEqual(len(self.song_queue), 5)
+
+    async def test_get_in_order(self) -> None:
+        self.song_queue.put_nowait("d", play_next=True, after="b")
+
+        songs = [await self.song_queue.get() for _ in range(4)]
+        self.assertEqual(songs, ["a", "b", "d", "c"])
+
+    async def test_get_while_looping(self) -> None:
+        self.song_queue.flip_is_looping()
+
+        self.assertEqual(await self.song_queue.get(), "a")
+        self.assertEqual(list(self.song_queue), ["b", "c", "a"])
+
+    def test_slices(self) -> None:
+        self.song_queue.extend_nowait(["d", "e", "f"])
+
+        self.assertEqual(self.song_queue[1:3], ["b", "c"])
+        self.assertEqual(self.song_queue[4:], ["e", "f"])
+        self.assertEqual(self.song_queue[::2], ["a", "c", "e"])
+        self.assertEqual(self.song_queue[-2:], ["e", "f"])
+
+    def test_remove(self) -> None:
+        self.assertEqual(self.song_queue.remove(index=1), "b")
+        self.assertIsNone(self.song_queue.remove(index=5))
+        self.assertEqual(list(self.song_queue), ["a", "c"])
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import spotipy
+from spotipy import SpotifyException
+
+from music_bot.spotify import SpotifyClientWrapper, create_spotify_session
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """Responds to the first request with a 429 and a Retry-After header, then with a track."""
+
+    def do_GET(self) -> None:
+        self.server.request_count += 1
+        if self.server.request_count == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "7")
+            body = {"error": {"status": 429, "message": "API rate limit exceeded"}}
+        else:
+            self.send_response(200)
+            body = {"name": "Track"}
+        content = json.dumps(body).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class TestSpotifyRateLimiting(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.server = HTTPServer(("127.0.0.1", 0), FakeSpotifyHandler)
+        self.server.request_count = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.sp_client = spotipy.Spotify(
+            auth="token", requests_session=create_spotify_session()
+        )
+        self.sp_client.prefix = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def test_429_is_not_retried_by_urllib3(self) -> None:
+        with mock.patch("time.sleep") as sleep:
+            with self.assertRaises(SpotifyException) as cm:
+                self.sp_client.track("id")
+        sleep.assert_not_called()
+        self.assertEqual(self.server.request_count, 1)
+        self.assertEqual(cm.exception.http_status, 429)
+        self.assertEqual(cm.exception.headers.get("Retry-After"), "7")
+
+    async def test_wrapper_waits_for_retry_after(self) -> None:
+        config = SimpleNamespace(
+            spotify_thread_pool_workers=1,
+            spotify_max_retries=3,
+            spotify_cache_size=1024,
+            spotify_cache_ttl=3600,
+        )
+        spotify_client_wrapper = SpotifyClientWrapper(config)
+        self.addCleanup(spotify_client_wrapper.close)
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            track = await spotify_client_wrapper.run_in_executor(
+                self.sp_client.track, "id"
+            )
+
+        self.assertEqual(track, {"name": "Track"})
+        self.assertEqual(self.server.request_count, 2)
+        sleep.assert_awaited_once()
+        self.assertAlmostEqual(sleep.await_args.args[0], 7, places=1)
+
+    async def test_rate_limit_cooldown_is_shared(self) -> None:
+        config = SimpleNamespace(
+            spotify_thread_pool_workers=1,
+            spotify_max_retries=0,
+            spotify_cache_size=1024,
+            spotify_cache_ttl=3600,
+        )
+        spotify_client_wrapper = SpotifyClientWrapper(config)
+        self.addCleanup(spotify_client_wrapper.close)
+        loop = asyncio.get_running_loop()
+
+        with self.assertRaises(SpotifyException):
+            await spotify_client_wrapper.run_in_executor(self.sp_client.track, "id")
+        self.assertAlmostEqual(
+            spotify_client_wrapper.rate_limited_until - loop.time(), 7, places=1
+        )
+
+        # Later calls wait out the cooldown before making a request
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            await spotify_client_wrapper.run_in_executor(self.sp_client.track, "id")
+        sleep.assert_awaited_once()
+        self.assertAlmostEqual(sleep.await_args.args[0], 7, places=1)
+        self.assertEqual(self.server.request_count, 2)
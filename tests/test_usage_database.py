@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from music_bot.usage_database import UsageDatabase
+from music_bot.usage_tables import SongPlay, SongRequest
+
+
+class TestUsageDatabaseWriter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        config = SimpleNamespace(
+            data_dir=data_dir.name,
+            usage_database_file_path=os.path.join(data_dir.name, "usage.db"),
+            reset_usage_database=False,
+            usage_database_flush_interval=0.01,
+            usage_database_batch_size=100,
+        )
+        self.usage_db = UsageDatabase(config)
+        await self.usage_db.initialize()
+        self.addAsyncCleanup(self.usage_db.close)
+
+    @staticmethod
+    def create_song_request(uuid: str) -> SongRequest:
+        return SongRequest(
+            uuid=uuid,
+            timestamp=datetime.now(),
+            guild_id=1,
+            requester_id=2,
+            song_id="song",
+        )
+
+    async def get_uuids(self, table: type[SongRequest | SongPlay]) -> list[str]:
+        async with self.usage_db.async_session() as session:
+            result = await session.execute(select(table.uuid).order_by(table.uuid))
+            return list(result.scalars())
+
+    async def test_queued_rows_are_written_in_one_batch(self) -> None:
+        for uuid in ["a", "b", "c"]:
+            self.usage_db.queue_data(self.create_song_request(uuid))
+        self.usage_db.queue_data(
+            SongPlay(
+                uuid="d",
+                timestamp=datetime.now(),
+                guild_id=1,
+                requester_id=2,
+                song_id="song",
+                duration=1.5,
+            )
+        )
+        await self.usage_db.flush()
+
+        self.assertEqual(await self.get_uuids(SongRequest), ["a", "b", "c"])
+        self.assertEqual(await self.get_uuids(SongPlay), ["d"])
+
+    async def test_bad_row_does_not_lose_the_rest_of_the_batch(self) -> None:
+        # The duplicate primary key fails the batch's transaction
+        for uuid in ["a", "b", "a", "c"]:
+            self.usage_db.queue_data(self.create_song_request(uuid))
+        with self.assertLogs("music_bot.usage_database") as logs:
+            await self.usage_db.flush()
+
+        self.assertEqual(await self.get_uuids(SongRequest), ["a", "b", "c"])
+        dropped_logs = [log for log in logs.output if "Dropped SongRequest" in log]
+        self.assertEqual(len(dropped_logs), 1)